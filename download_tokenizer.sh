@@ -0,0 +1,3 @@
+pip install huggingface_hub
+# Tokenizer of the model served by the LLM endpoint, set TOKENIZER_REPO if a different model is deployed
+python -c "from huggingface_hub import hf_hub_download; hf_hub_download('${TOKENIZER_REPO:-mistralai/Mixtral-8x7B-Instruct-v0.1}', 'tokenizer.json', local_dir='functions/layers/tokenizer_data/tokenizer')"
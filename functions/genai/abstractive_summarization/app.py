@@ -1,63 +1,61 @@
 import boto3
-import ast
-import json
 import os
+import time
 from aws_lambda_powertools import Logger
+from genai_common.document_state import ABSTRACTED, DocumentState
+from genai_common.generation import ABSTRACT_MAX_INPUT_TOKENS, ABSTRACT_PROMPT_TEMPLATE, ABSTRACT_PROMPT_VERSION, generate
+from genai_common.inference_cache import InferenceCache
+from genai_common.inference_client import InferenceClient
+from genai_common.prompt_builder import max_chars_for
+from genai_common.result_record import WRITE_FIELD_OBJECTS
+from genai_common.s3_reader import read_text_from_s3
+from genai_common.visibility import keep_message_invisible
 
 logger = Logger()
 
 ENV = os.environ['ENV']
 ENDPOINT_NAME = f"{ENV}-{os.environ['ENDPOINT_NAME']}"
+MODEL_NAME = os.environ.get('MODEL_NAME', ENDPOINT_NAME)
 OUTPUT_BUCKET = os.environ['OUTPUT_BUCKET']
 EXTRACTIVE_SUMMARY_BUCKET = os.environ['EXTRACTIVE_SUMMARY_BUCKET']
-sagemaker = boto3.client('sagemaker-runtime')
 
 s3 = boto3.client('s3')
-char_count = 10_000
-
-
-def read_file_from_s3(bucket, key):
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    return obj['Body'].read().decode('utf-8', errors='ignore')
+sagemaker = InferenceClient(ENDPOINT_NAME)
+cache = InferenceCache(sagemaker, MODEL_NAME, 'abstract', ABSTRACT_PROMPT_VERSION)
 
 
+@keep_message_invisible
 def lambda_handler(event, context):
     file_name = event.get('uid')
     logger.info(f"file_name: {file_name}")
 
-    text = read_file_from_s3(EXTRACTIVE_SUMMARY_BUCKET, file_name)
-    inputs = f'<s>[INST] <<SYS>>\nWrite an abstract given the following text\n<</SYS>>\n\n{text[:char_count]} [/INST]'
-    logger.info(f"inputs: {inputs}")
-
-    payload = json.dumps(
-        {
-            "inputs": inputs,
-            "parameters": {
-                "max_new_tokens": 512,
-                "top_p": 0.1,
-                "temperature": 0.1
-            }
-        }
-    )
-
-    response = sagemaker.invoke_endpoint(
-        EndpointName=ENDPOINT_NAME,
-        Body=payload,
-        ContentType='application/json'
-    )
-
-    response = response['Body'].read().decode('utf-8')
-    summary = ast.literal_eval(response)[0]['generated_text'][len(inputs):]
+    started = time.perf_counter()
+    state = DocumentState(event.get('extracts_uid') or file_name)
+    version = f"{MODEL_NAME}:{ABSTRACT_PROMPT_VERSION}"
+    summary = state.completed_output(ABSTRACTED, version)
+    if summary is None:
+        # The extractive summary is passed in the state, it is only read from S3 when started on its own
+        text = event.get('summary')
+        if text is None:
+            text = read_text_from_s3(s3, EXTRACTIVE_SUMMARY_BUCKET, file_name, max_chars=max_chars_for(ABSTRACT_MAX_INPUT_TOKENS))
+        summary = generate(cache, ABSTRACT_PROMPT_TEMPLATE, text, ABSTRACT_MAX_INPUT_TOKENS)
+        state.complete(ABSTRACTED, summary, version)
+    else:
+        state.stage_done(ABSTRACTED)
     logger.info(f"summary: {summary}")
 
-    s3.put_object(
-        Body=summary,
-        Bucket=OUTPUT_BUCKET,
-        Key=file_name
-    )
+    if WRITE_FIELD_OBJECTS:
+        s3.put_object(
+            Body=summary,
+            Bucket=OUTPUT_BUCKET,
+            Key=file_name
+        )
 
     return {
         'statusCode': 200,
         'uid': file_name,
+        'abstract': summary,
+        'model': {'name': MODEL_NAME, 'prompt_version': ABSTRACT_PROMPT_VERSION},
+        'seconds': round(time.perf_counter() - started, 3),
         "MessageDetails": event.get("MessageDetails")
     }
@@ -0,0 +1,177 @@
+import boto3
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from genai_common.document_state import ABSTRACTED, AUTHORS_EXTRACTED, DONE, SUMMARIZED, TITLED, DocumentState
+from genai_common.extractive import (
+    CHUNKED_MIN_BYTES,
+    SENTENCES_COUNT,
+    chunked_summary,
+    ext_summary_with_timeout,
+    get_nlp_resources,
+    init_nltk
+)
+from genai_common.generation import (
+    ABSTRACT_MAX_INPUT_TOKENS,
+    ABSTRACT_PROMPT_TEMPLATE,
+    ABSTRACT_PROMPT_VERSION,
+    TITLE_MAX_INPUT_TOKENS,
+    TITLE_PROMPT_TEMPLATE,
+    TITLE_PROMPT_VERSION,
+    generate
+)
+from genai_common.inference_cache import InferenceCache
+from genai_common.inference_client import InferenceClient
+from genai_common.ner import FIRST_PAGE_CHARS, NER_PROMPT_VERSION, extract_authors
+from genai_common.result_record import WRITE_FIELD_OBJECTS, build_record, write_record
+from genai_common.s3_reader import iter_decoded, read_text_from_s3
+from genai_common.visibility import keep_message_invisible
+
+ENV = os.environ['ENV']
+EXTRACTS_BUCKET = os.environ['EXTRACTS_BUCKET']
+EXTRACTIVE_SUMMARY_BUCKET = os.environ['EXTRACTIVE_SUMMARY_BUCKET']
+GENERATED_TITLE_BUCKET = os.environ['GENERATED_TITLE_BUCKET']
+ABSTRACTIVE_SUMMARY_BUCKET = os.environ['ABSTRACTIVE_SUMMARY_BUCKET']
+AUTHOR_EXTRACTION_BUCKET = os.environ['AUTHOR_EXTRACTION_BUCKET']
+LLM_ENDPOINT_NAME = f"{ENV}-{os.environ['LLM_ENDPOINT_NAME']}"
+NER_ENDPOINT_NAME = f"{ENV}-{os.environ['NER_ENDPOINT_NAME']}"
+LLM_MODEL_NAME = os.environ.get('LLM_MODEL_NAME', LLM_ENDPOINT_NAME)
+NER_MODEL_NAME = os.environ.get('NER_MODEL_NAME', NER_ENDPOINT_NAME)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+llm = InferenceClient(LLM_ENDPOINT_NAME)
+ner = InferenceClient(NER_ENDPOINT_NAME)
+# Same cache entries as the per-stage functions, so both modes reuse each other's results
+title_cache = InferenceCache(llm, LLM_MODEL_NAME, 'title', TITLE_PROMPT_VERSION)
+abstract_cache = InferenceCache(llm, LLM_MODEL_NAME, 'abstract', ABSTRACT_PROMPT_VERSION)
+author_cache = InferenceCache(ner, NER_MODEL_NAME, 'author', NER_PROMPT_VERSION)
+
+MODELS = {
+    'title': {'name': LLM_MODEL_NAME, 'prompt_version': TITLE_PROMPT_VERSION},
+    'abstract': {'name': LLM_MODEL_NAME, 'prompt_version': ABSTRACT_PROMPT_VERSION},
+    'author': {'name': NER_MODEL_NAME, 'prompt_version': NER_PROMPT_VERSION}
+}
+# Checkpointed stage outputs are only reused when they were produced by the same model and prompt
+TITLE_VERSION = f"{LLM_MODEL_NAME}:{TITLE_PROMPT_VERSION}"
+ABSTRACT_VERSION = f"{LLM_MODEL_NAME}:{ABSTRACT_PROMPT_VERSION}"
+AUTHOR_VERSION = f"{NER_MODEL_NAME}:{NER_PROMPT_VERSION}"
+
+# One thread per endpoint call and output upload
+executor = ThreadPoolExecutor(max_workers=5)
+
+_init_started = time.perf_counter()
+init_nltk()
+get_nlp_resources()
+INIT_SECONDS = time.perf_counter() - _init_started
+logger.info(f"Init completed in {INIT_SECONDS:.3f}s")
+
+
+def run_stage(state, stage, version, fn, *args):
+    """
+    Output of stage from its checkpoint, or run fn(*args) and checkpoint its output
+    """
+    output = state.completed_output(stage, version)
+    if output is None:
+        output = fn(*args)
+        state.complete(stage, output, version)
+    else:
+        state.stage_done(stage)
+    return output
+
+
+def first_page_authors(extracts_file_name):
+    first_page = read_text_from_s3(s3, EXTRACTS_BUCKET, extracts_file_name, max_chars=FIRST_PAGE_CHARS)
+    return extract_authors(author_cache, first_page)
+
+
+@keep_message_invisible
+def lambda_handler(event, context):
+    """
+    Run extractive summarization, title generation, abstractive summarization and author
+    extraction for one document in a single invocation. Text is passed between the stages in
+    memory, the three endpoint calls run concurrently and the result record (and optionally the
+    per-field objects) is written at the end.
+    """
+    started = time.perf_counter()
+    extracts_file_name = json.loads(event.get('body')).get('uid')
+    output_key = extracts_file_name.replace("_extracted_text.txt", ".txt")
+    logger.info(f"extracts_file_name: {extracts_file_name}")
+
+    state = DocumentState(extracts_file_name)
+    summary = state.completed_output(SUMMARIZED, SENTENCES_COUNT)
+    chunked = None
+    authors = None
+    if summary is None:
+        obj = s3.get_object(Bucket=EXTRACTS_BUCKET, Key=extracts_file_name)
+        chunked = obj['ContentLength'] > CHUNKED_MIN_BYTES
+        if chunked:
+            # Chunks are summarized on forked processes, so no endpoint call is in flight until that is done
+            summary = chunked_summary(iter_decoded(obj['Body']), SENTENCES_COUNT=SENTENCES_COUNT, context=context)
+        else:
+            text = obj['Body'].read().decode('utf-8', errors='ignore')
+            # Authors only need the first page, so NER runs while the document is summarized
+            authors = executor.submit(
+                run_stage, state, AUTHORS_EXTRACTED, AUTHOR_VERSION, extract_authors, author_cache, text[:FIRST_PAGE_CHARS]
+            )
+            summary = ext_summary_with_timeout(text, SENTENCES_COUNT=SENTENCES_COUNT, context=context)
+        state.complete(SUMMARIZED, summary, SENTENCES_COUNT)
+    else:
+        state.stage_done(SUMMARIZED)
+    if authors is None:
+        authors = executor.submit(run_stage, state, AUTHORS_EXTRACTED, AUTHOR_VERSION, first_page_authors, extracts_file_name)
+    summary_done = time.perf_counter()
+
+    title = executor.submit(
+        run_stage, state, TITLED, TITLE_VERSION, generate, title_cache, TITLE_PROMPT_TEMPLATE, summary, TITLE_MAX_INPUT_TOKENS
+    )
+    abstract = executor.submit(
+        run_stage, state, ABSTRACTED, ABSTRACT_VERSION, generate, abstract_cache, ABSTRACT_PROMPT_TEMPLATE, summary, ABSTRACT_MAX_INPUT_TOKENS
+    )
+
+    outputs = {
+        EXTRACTIVE_SUMMARY_BUCKET: summary,
+        GENERATED_TITLE_BUCKET: title.result(),
+        ABSTRACTIVE_SUMMARY_BUCKET: abstract.result(),
+        AUTHOR_EXTRACTION_BUCKET: authors.result()
+    }
+    inference_done = time.perf_counter()
+
+    timings = {
+        'chunked': chunked,
+        'summarize_seconds': round(summary_done - started, 3),
+        'inference_seconds': round(inference_done - summary_done, 3)
+    }
+    record = build_record(
+        uid=output_key,
+        extractive_summary=summary,
+        title=outputs[GENERATED_TITLE_BUCKET],
+        abstract=outputs[ABSTRACTIVE_SUMMARY_BUCKET],
+        authors=outputs[AUTHOR_EXTRACTION_BUCKET],
+        models=MODELS,
+        timings=timings
+    )
+
+    uploads = [executor.submit(write_record, s3, output_key, record)]
+    if WRITE_FIELD_OBJECTS:
+        uploads.extend(
+            executor.submit(s3.put_object, Body=body, Bucket=bucket, Key=output_key)
+            for bucket, body in outputs.items()
+        )
+    for upload in uploads:
+        upload.result()
+    state.advance(DONE, result_key=output_key)
+
+    timings['total_seconds'] = round(time.perf_counter() - started, 3)
+    logger.info(f"timings: {json.dumps(timings)}")
+
+    return {
+        'statusCode': 200,
+        'uid': output_key,
+        "MessageDetails": event.get("MessageDetails")
+    }
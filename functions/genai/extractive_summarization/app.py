@@ -1,90 +1,48 @@
 import boto3
 import logging
-import nltk
-from sumy.parsers.plaintext import PlaintextParser
-from sumy.nlp.tokenizers import Tokenizer
-from sumy.nlp.stemmers import Stemmer
-from sumy.summarizers.luhn import LuhnSummarizer
-from sumy.utils import get_stop_words
-from sumy.summarizers.text_rank import TextRankSummarizer
-
 import os
 import json
-import threading
+import time
+
+from genai_common.extractive import (
+    CHUNK_CHARS,
+    CHUNKED_MIN_BYTES,
+    SENTENCES_COUNT,
+    chunked_summary,
+    ext_summary_with_timeout,
+    get_nlp_resources,
+    init_nltk
+)
+from genai_common.document_state import SUMMARIZED, DocumentState
+from genai_common.result_record import WRITE_FIELD_OBJECTS
+from genai_common.s3_reader import iter_decoded
+from genai_common.visibility import keep_message_invisible
 
 s3 = boto3.client('s3')
-nltk_data_path = os.path.join(os.getcwd(), 'nltk_data')
 
 EXTRACTS_BUCKET = os.environ['EXTRACTS_BUCKET']
 OUTPUT_BUCKET = os.environ['OUTPUT_BUCKET']
 
-SENTENCES_COUNT = 10
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-logger.info(f"nltk_data_path: {nltk_data_path}")
-logger.info(f"NLTK files: {os.listdir(nltk_data_path)}")
-
-
-def init_nltk():
-    try:
-        nltk.data.path.append(nltk_data_path)
-        nltk.data.find('tokenizers/punkt')
-        logger.info("NLTK data found successfully")
-    except LookupError as e:
-        logger.error(f"NLTK data not found: {str(e)}")
-        raise
-
-
-def read_file_from_s3(bucket, key):
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    return obj['Body'].read().decode('utf-8', errors='ignore')
-
-
-def summarize_text(text, SENTENCES_COUNT=SENTENCES_COUNT):
-    stemmer = Stemmer("english")
-    parser = PlaintextParser.from_string(text, Tokenizer("english"))
-
-    summarizer = TextRankSummarizer(stemmer)
-    summarizer.stop_words = get_stop_words("english")
-
-    summary = summarizer(parser.document, SENTENCES_COUNT)
-    text_summary = ""
-    for sentence in summary:
-        text_summary += str(sentence)
-
-    return text_summary
+_cold_start = True
 
 
-def luhn_summarization(text, SENTENCES_COUNT=SENTENCES_COUNT):
-    print("Switching to Luhn summarization for time optimization.")
-    parser = PlaintextParser.from_string(text, Tokenizer("english"))
-    summarizer = LuhnSummarizer()
-    summary = summarizer(parser.document, SENTENCES_COUNT)
-    summary_sentences = [str(sentence) for sentence in summary]
-    return " ".join(summary_sentences)
-
-
-def ext_summary_with_timeout(text, SENTENCES_COUNT=SENTENCES_COUNT, timeout=600):
-    result = []
-
-    def summarization_task():
-        result.append(summarize_text(text, SENTENCES_COUNT=SENTENCES_COUNT))
-
-    thread = threading.Thread(target=summarization_task)
-    thread.start()
-
-    thread.join(timeout=timeout)
-
-    if thread.is_alive():
-        print("Time exceeded, switching to Luhn summarization.")
-        thread.join()  # Clean up thread
-        return luhn_summarization(text, SENTENCES_COUNT=SENTENCES_COUNT)
-    else:
-        return result[0] if result else "No summary generated."
+# Load punkt and build the NLP resources during the init phase so warm invocations reuse them
+_init_started = time.perf_counter()
+init_nltk()
+get_nlp_resources()
+INIT_SECONDS = time.perf_counter() - _init_started
+logger.info(f"Init completed in {INIT_SECONDS:.3f}s")
 
 
+@keep_message_invisible
 def lambda_handler(event, context):
+    global _cold_start
+    cold_start = _cold_start
+    _cold_start = False
+    started = time.perf_counter()
     logger.info(f"event: {event}")
 
     init_nltk()
@@ -93,17 +51,50 @@ def lambda_handler(event, context):
     logger.info(f"extracts_file_name: {extracts_file_name}")
     extractive_summary_file_name = extracts_file_name.replace("_extracted_text.txt", ".txt")
 
-    text = read_file_from_s3(EXTRACTS_BUCKET, extracts_file_name)
-    text_summary = ext_summary_with_timeout(text, SENTENCES_COUNT=SENTENCES_COUNT)
-
-    s3.put_object(
-        Body=text_summary,
-        Bucket=OUTPUT_BUCKET,
-        Key=extractive_summary_file_name
-    )
+    state = DocumentState(extracts_file_name)
+    chunked = None
+    text_summary = state.completed_output(SUMMARIZED, SENTENCES_COUNT)
+    read_done = time.perf_counter()
+    if text_summary is None:
+        obj = s3.get_object(Bucket=EXTRACTS_BUCKET, Key=extracts_file_name)
+        chunked = obj['ContentLength'] > CHUNKED_MIN_BYTES
+        if chunked:
+            # Reading and summarizing overlap in chunked mode, the read time is included in summarize_seconds
+            read_done = time.perf_counter()
+            logger.info(f"Summarizing {obj['ContentLength']} bytes in chunks of {CHUNK_CHARS} characters")
+            text_summary = chunked_summary(iter_decoded(obj['Body']), SENTENCES_COUNT=SENTENCES_COUNT, context=context)
+        else:
+            text = obj['Body'].read().decode('utf-8', errors='ignore')
+            read_done = time.perf_counter()
+            text_summary = ext_summary_with_timeout(text, SENTENCES_COUNT=SENTENCES_COUNT, context=context)
+        state.complete(SUMMARIZED, text_summary, SENTENCES_COUNT)
+    else:
+        state.stage_done(SUMMARIZED)
+    summary_done = time.perf_counter()
+
+    if WRITE_FIELD_OBJECTS:
+        s3.put_object(
+            Body=text_summary,
+            Bucket=OUTPUT_BUCKET,
+            Key=extractive_summary_file_name
+        )
+
+    timings = {
+        'cold_start': cold_start,
+        'chunked': chunked,
+        'init_seconds': round(INIT_SECONDS, 3) if cold_start else 0,
+        'read_seconds': round(read_done - started, 3),
+        'summarize_seconds': round(summary_done - read_done, 3),
+        'total_seconds': round(time.perf_counter() - started, 3)
+    }
+    logger.info(f"timings: {json.dumps(timings)}")
 
     return {
         'statusCode': 200,
         'uid': extractive_summary_file_name,
+        'extracts_uid': extracts_file_name,
+        # Passed on to title and abstract generation and to the result record
+        'summary': text_summary,
+        'seconds': timings['total_seconds'],
         "MessageDetails": event.get("MessageDetails")
     }
@@ -1,61 +1,60 @@
 import boto3
-import ast
-import json
 import os
-
+import time
 from aws_lambda_powertools import Logger
+from genai_common.document_state import TITLED, DocumentState
+from genai_common.generation import TITLE_MAX_INPUT_TOKENS, TITLE_PROMPT_TEMPLATE, TITLE_PROMPT_VERSION, generate
+from genai_common.inference_cache import InferenceCache
+from genai_common.inference_client import InferenceClient
+from genai_common.prompt_builder import max_chars_for
+from genai_common.result_record import WRITE_FIELD_OBJECTS
+from genai_common.s3_reader import read_text_from_s3
+from genai_common.visibility import keep_message_invisible
+
 logger = Logger()
 
 ENV = os.environ['ENV']
 ENDPOINT_NAME = f"{ENV}-{os.environ['ENDPOINT_NAME']}"
+MODEL_NAME = os.environ.get('MODEL_NAME', ENDPOINT_NAME)
 OUTPUT_BUCKET = os.environ['OUTPUT_BUCKET']
 EXTRACTIVE_SUMMARY_BUCKET = os.environ['EXTRACTIVE_SUMMARY_BUCKET']
 
-sagemaker = boto3.client('sagemaker-runtime')
 s3 = boto3.client('s3')
-
-char_count = 10_000
-
-
-def read_file_from_s3(bucket, key):
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    return obj['Body'].read().decode('utf-8', errors='ignore')
+sagemaker = InferenceClient(ENDPOINT_NAME)
+cache = InferenceCache(sagemaker, MODEL_NAME, 'title', TITLE_PROMPT_VERSION)
 
 
+@keep_message_invisible
 def lambda_handler(event, context):
     file_name = event.get('uid')
-    text = read_file_from_s3(EXTRACTIVE_SUMMARY_BUCKET, file_name)
-
-    inputs = f'<s>[INST] <<SYS>>\nYou are a robot that generates a title given some text. You only provide the title and nothing else. Generate a title given the following text:\n<</SYS>>\n\n{text[:char_count]} [/INST]'
-    payload = json.dumps(
-        {
-            "inputs": inputs,
-            "parameters": {
-                "max_new_tokens": 512,
-                "top_p": 0.1,
-                "temperature": 0.1
-            }
-        }
-    )
-
-    response = sagemaker.invoke_endpoint(
-        EndpointName=ENDPOINT_NAME,
-        Body=payload,
-        ContentType='application/json'
-    )
-
-    response = response['Body'].read().decode('utf-8')
-    title = ast.literal_eval(response)[0]['generated_text'][len(inputs):]
+    started = time.perf_counter()
+    state = DocumentState(event.get('extracts_uid') or file_name)
+    version = f"{MODEL_NAME}:{TITLE_PROMPT_VERSION}"
+    title = state.completed_output(TITLED, version)
+    if title is None:
+        # The extractive summary is passed in the state, it is only read from S3 when started on its own
+        text = event.get('summary')
+        if text is None:
+            text = read_text_from_s3(s3, EXTRACTIVE_SUMMARY_BUCKET, file_name, max_chars=max_chars_for(TITLE_MAX_INPUT_TOKENS))
+
+        title = generate(cache, TITLE_PROMPT_TEMPLATE, text, TITLE_MAX_INPUT_TOKENS)
+        state.complete(TITLED, title, version)
+    else:
+        state.stage_done(TITLED)
     logger.info(f"title: {title}")
 
-    s3.put_object(
-        Body=title,
-        Bucket=OUTPUT_BUCKET,
-        Key=file_name
-    )
+    if WRITE_FIELD_OBJECTS:
+        s3.put_object(
+            Body=title,
+            Bucket=OUTPUT_BUCKET,
+            Key=file_name
+        )
 
     return {
         'statusCode': 200,
         'uid': file_name,
+        'title': title,
+        'model': {'name': MODEL_NAME, 'prompt_version': TITLE_PROMPT_VERSION},
+        'seconds': round(time.perf_counter() - started, 3),
         "MessageDetails": event.get("MessageDetails")
     }
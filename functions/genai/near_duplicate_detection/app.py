@@ -0,0 +1,250 @@
+import boto3
+import hashlib
+import json
+import os
+import re
+import time
+import numpy as np
+from botocore.exceptions import ClientError
+from aws_lambda_powertools import Logger
+from genai_common.document_state import DONE, DocumentState
+from genai_common.result_record import RESULTS_BUCKET, WRITE_FIELD_OBJECTS, read_record, write_record
+from genai_common.s3_reader import read_text_from_s3
+from genai_common.visibility import keep_message_invisible
+
+logger = Logger()
+
+EXTRACTS_BUCKET = os.environ['EXTRACTS_BUCKET']
+EXTRACTIVE_SUMMARY_BUCKET = os.environ['EXTRACTIVE_SUMMARY_BUCKET']
+GENERATED_TITLE_BUCKET = os.environ['GENERATED_TITLE_BUCKET']
+ABSTRACTIVE_SUMMARY_BUCKET = os.environ['ABSTRACTIVE_SUMMARY_BUCKET']
+AUTHOR_EXTRACTION_BUCKET = os.environ['AUTHOR_EXTRACTION_BUCKET']
+NEAR_DUPLICATE_INDEX_TABLE = os.environ['NEAR_DUPLICATE_INDEX_TABLE']
+
+# Estimated Jaccard similarity of word shingles above which a document reuses earlier results
+SIMILARITY_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.9))
+NUM_PERM = int(os.environ.get('MINHASH_NUM_PERM', 128))
+SHINGLE_SIZE = int(os.environ.get('SHINGLE_SIZE', 5))
+# Documents with fewer shingles, such as empty or very short extracts, share near identical
+# signatures, they are treated as unique and not registered
+MIN_SHINGLES = int(os.environ.get('NEAR_DUPLICATE_MIN_SHINGLES', 10))
+MAX_CHARS = int(os.environ.get('NEAR_DUPLICATE_MAX_CHARS', 2_000_000))
+TIME_TO_LIVE_DAYS = int(os.environ.get('DOC_STATE_TTL_DAYS', 30))
+# Documents listed per LSH band, later documents of a full band are found through their other bands
+MAX_BAND_UIDS = int(os.environ.get('LSH_MAX_BAND_UIDS', 20))
+
+# Signatures and bands share the index table, so their keys are kept apart with prefixes
+SIGNATURE_KEY_PREFIX = "minhash#"
+BAND_KEY_PREFIX = "lsh#"
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+HASH_CHUNK = 10_000
+WORD = re.compile(r'\w+')
+
+# Per-field results reused from a near duplicate along with its result record, all must exist before any is copied
+OUTPUT_BUCKETS = [
+    EXTRACTIVE_SUMMARY_BUCKET,
+    GENERATED_TITLE_BUCKET,
+    ABSTRACTIVE_SUMMARY_BUCKET,
+    AUTHOR_EXTRACTION_BUCKET
+]
+
+s3 = boto3.client('s3')
+ddb = boto3.client('dynamodb')
+
+# Same permutations in every container so signatures can be compared across invocations
+_generator = np.random.RandomState(1)
+# Below 2**32 so a * hash + b of a 32 bit hash cannot overflow 64 bits
+PERM_A = _generator.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _generator.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def lsh_params(threshold, num_perm):
+    """
+    Number of bands and rows per band whose S-curve threshold (1/b)^(1/r) is closest to threshold
+    """
+    return min(
+        ((num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0),
+        key=lambda params: abs((1 / params[0]) ** (1 / params[1]) - threshold)
+    )
+
+
+# Candidates are checked against the full signature, so the LSH threshold is set lower to favour recall
+BANDS, ROWS = lsh_params(SIMILARITY_THRESHOLD * 0.8, NUM_PERM)
+
+
+def shingles(text):
+    words = WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    """
+    MinHash signature of a set of shingles as NUM_PERM uint32 values
+    """
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little') for shingle in shingle_set),
+        dtype=np.uint64,
+        count=len(shingle_set)
+    )
+    signature = np.full(NUM_PERM, MAX_HASH, dtype=np.uint64)
+    # Hashed in chunks to bound the memory of the shingles x permutations matrix
+    for start in range(0, len(hashes), HASH_CHUNK):
+        chunk = hashes[start:start + HASH_CHUNK, None]
+        permuted = ((chunk * PERM_A + PERM_B) % MERSENNE_PRIME) & MAX_HASH
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature.astype(np.uint32)
+
+
+def band_keys(signature):
+    return [
+        f"{BAND_KEY_PREFIX}{band}#{hashlib.sha1(signature[band * ROWS:(band + 1) * ROWS].tobytes()).hexdigest()}"
+        for band in range(BANDS)
+    ]
+
+
+def _batch_get(keys, attributes):
+    """
+    BatchGetItem of up to 100 keys, retrying unprocessed keys
+    """
+    request = {
+        NEAR_DUPLICATE_INDEX_TABLE: {
+            'Keys': [{'index_key': {'S': key}} for key in keys],
+            'ProjectionExpression': ', '.join(['index_key'] + attributes)
+        }
+    }
+    items = []
+    for attempt in range(5):
+        response = ddb.batch_get_item(RequestItems=request)
+        items.extend(response['Responses'].get(NEAR_DUPLICATE_INDEX_TABLE, []))
+        request = response.get('UnprocessedKeys')
+        if not request:
+            break
+        time.sleep(min(0.05 * 2 ** attempt, 1))
+    return items
+
+
+def find_candidates(uid, signature, keys):
+    """
+    Documents sharing at least one LSH band, with their estimated similarity, most similar first
+    """
+    candidates = {candidate for item in _batch_get(keys, ['uids']) for candidate in item['uids']['SS']} - {uid}
+    if not candidates:
+        return []
+
+    scored = []
+    for item in _batch_get([f"{SIGNATURE_KEY_PREFIX}{candidate}" for candidate in candidates], ['signature']):
+        other = np.frombuffer(item['signature']['B'], dtype=np.uint32)
+        if len(other) == NUM_PERM:
+            scored.append((float(np.mean(other == signature)), item['index_key']['S'][len(SIGNATURE_KEY_PREFIX):]))
+    return sorted(scored, reverse=True)
+
+
+def register(uid, signature, keys):
+    """
+    Store the signature and add this document to the uid set of every band of it, unless the
+    band already lists MAX_BAND_UIDS documents
+    """
+    expiry = str(int(time.time()) + TIME_TO_LIVE_DAYS * 86400)
+    ddb.put_item(
+        TableName=NEAR_DUPLICATE_INDEX_TABLE,
+        Item={
+            'index_key': {'S': f"{SIGNATURE_KEY_PREFIX}{uid}"},
+            'signature': {'B': signature.tobytes()},
+            'ttl': {'N': expiry}
+        }
+    )
+
+    full = 0
+    for key in keys:
+        try:
+            ddb.update_item(
+                TableName=NEAR_DUPLICATE_INDEX_TABLE,
+                Key={'index_key': {'S': key}},
+                UpdateExpression='ADD uids :uid SET #ttl = :ttl',
+                ConditionExpression='attribute_not_exists(uids) OR size(uids) < :max_uids',
+                ExpressionAttributeNames={'#ttl': 'ttl'},
+                ExpressionAttributeValues={
+                    ':uid': {'SS': [uid]},
+                    ':ttl': {'N': expiry},
+                    ':max_uids': {'N': str(MAX_BAND_UIDS)}
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            full += 1
+    if full:
+        logger.info(f"{full} of {len(keys)} bands already list {MAX_BAND_UIDS} documents")
+
+
+def _outputs_exist(output_key):
+    for bucket in [RESULTS_BUCKET] + (OUTPUT_BUCKETS if WRITE_FIELD_OBJECTS else []):
+        try:
+            s3.head_object(Bucket=bucket, Key=output_key)
+        except ClientError as e:
+            # Without s3:ListBucket a missing key is reported as 403
+            if e.response['Error']['Code'] in ('404', '403', 'NoSuchKey'):
+                return False
+            raise
+    return True
+
+
+def copy_outputs(source_key, output_key):
+    record = read_record(s3, source_key)
+    record.update(uid=output_key, duplicate_of=source_key)
+    write_record(s3, output_key, record)
+
+    if not WRITE_FIELD_OBJECTS:
+        return
+    for bucket in OUTPUT_BUCKETS:
+        s3.copy_object(
+            Bucket=bucket,
+            Key=output_key,
+            CopySource={'Bucket': bucket, 'Key': source_key}
+        )
+
+
+@keep_message_invisible
+def lambda_handler(event, context):
+    extracts_file_name = json.loads(event.get('body')).get('uid')
+    output_key = extracts_file_name.replace("_extracted_text.txt", ".txt")
+    logger.info(f"extracts_file_name: {extracts_file_name}")
+
+    text = read_text_from_s3(s3, EXTRACTS_BUCKET, extracts_file_name, max_chars=MAX_CHARS)
+    shingle_set = shingles(text)
+    if len(shingle_set) < MIN_SHINGLES:
+        logger.info(f"{len(shingle_set)} shingles, too few to detect near duplicates, processing in full")
+        return {
+            'statusCode': 200,
+            'uid': output_key,
+            'duplicate_of': None
+        }
+
+    signature = minhash(shingle_set)
+    keys = band_keys(signature)
+
+    duplicate_of = None
+    for similarity, candidate in find_candidates(extracts_file_name, signature, keys):
+        if similarity < SIMILARITY_THRESHOLD:
+            break
+
+        candidate_key = candidate.replace("_extracted_text.txt", ".txt")
+        # The candidate may still be in flight or may have failed, then this document is processed in full
+        if _outputs_exist(candidate_key):
+            logger.info(f"Near duplicate of {candidate} (similarity {similarity:.3f}), copying its results")
+            copy_outputs(candidate_key, output_key)
+            duplicate_of = candidate
+            DocumentState(extracts_file_name).advance(DONE, duplicate_of=candidate, result_key=output_key)
+            break
+
+    register(extracts_file_name, signature, keys)
+
+    return {
+        'statusCode': 200,
+        'uid': output_key,
+        'duplicate_of': duplicate_of
+    }
@@ -0,0 +1,38 @@
+import boto3
+from aws_lambda_powertools import Logger
+from genai_common.document_state import DONE, DocumentState
+from genai_common.result_record import build_record, write_record
+from genai_common.visibility import keep_message_invisible
+
+logger = Logger()
+
+s3 = boto3.client('s3')
+
+
+@keep_message_invisible
+def lambda_handler(event, context):
+    """
+    Write the consolidated result record of a document processed by the per-stage functions.
+    The state machine collects the stage outputs in $.Result.
+    """
+    result = event['Result']
+    file_name = result['uid']
+
+    record = build_record(
+        uid=file_name,
+        extractive_summary=result['extractive_summary'],
+        title=result['title'],
+        abstract=result['abstract'],
+        authors=result['authors'],
+        models=result['models'],
+        timings=result['timings']
+    )
+    write_record(s3, file_name, record)
+    logger.info(f"Result record written for {file_name}")
+    DocumentState(result.get('extracts_uid') or file_name).advance(DONE, result_key=file_name)
+
+    return {
+        'statusCode': 200,
+        'uid': file_name,
+        "MessageDetails": event.get("MessageDetails")
+    }
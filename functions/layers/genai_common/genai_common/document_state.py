@@ -0,0 +1,192 @@
+import datetime
+import logging
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STATE_TABLE = os.environ.get('DOC_DDB_STATE_TABLE', '')
+TIME_TO_LIVE_DAYS = int(os.environ.get('DOC_STATE_TTL_DAYS', 30))
+
+# Status of a document, push_to_queue writes INGESTED and the result record writers DONE
+INGESTED = 'INGESTED'
+DONE = 'DONE'
+STATUS_RANK = {INGESTED: 0, DONE: 1}
+
+# Stages of a document. They run as a graph, title and abstract concurrently, so their completion is
+# recorded in the stages set of the status item rather than as a status.
+AUTHORS_EXTRACTED = 'AUTHORS_EXTRACTED'
+SUMMARIZED = 'SUMMARIZED'
+TITLED = 'TITLED'
+ABSTRACTED = 'ABSTRACTED'
+
+# Stage checkpoints are kept on their own item, so re-ingesting a document resets its status but not its progress
+CHECKPOINT_KEY_PREFIX = "stages#"
+# Larger outputs are not kept, and their stage runs again on resume. DynamoDB items are limited to 400 KB.
+MAX_OUTPUT_BYTES = 90_000
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class DocumentState:
+    """
+    Processing state of one document in the document state table, keyed by its extracts key.
+    Stage outputs are checkpointed with the model and prompt version that produced them, completed
+    stages are added to the stages set of the status item, and the document status only moves
+    forward. Every write is conditional or idempotent, so retries and SQS redeliveries can repeat
+    them safely. Errors are logged and processing carries on without state.
+    """
+    def __init__(self, uid, table_name=STATE_TABLE):
+        self.uid = uid
+        self.table_name = table_name
+        self.ddb = boto3.client('dynamodb') if table_name else None
+        self._checkpoints = None
+
+    def _checkpoint_key(self):
+        return {'s3_path': {'S': f"{CHECKPOINT_KEY_PREFIX}{self.uid}"}}
+
+    def checkpoints(self):
+        if self._checkpoints is None:
+            self._checkpoints = {}
+            if self.ddb is not None:
+                try:
+                    self._checkpoints = self.ddb.get_item(
+                        TableName=self.table_name,
+                        Key=self._checkpoint_key(),
+                        ConsistentRead=True
+                    ).get('Item', {})
+                except ClientError as e:
+                    logger.warning(f"Document state read failed for {self.uid}: {e}")
+        return self._checkpoints
+
+    def completed_output(self, stage, version=''):
+        """
+        Output recorded for stage by the same version, None if the stage has to run
+        """
+        item = self.checkpoints()
+        stage = stage.lower()
+        if f"{stage}_output" not in item or item.get(f"{stage}_version", {}).get('S') != str(version):
+            return None
+        logger.info(f"{stage} of {self.uid} already done, skipping it")
+        return item[f"{stage}_output"]['S']
+
+    def complete(self, stage, output=None, version=''):
+        """
+        Checkpoint the output of stage and record the stage as done. The checkpoint is only written
+        if the stage has not been recorded by the same version already.
+        """
+        if self.ddb is None:
+            return
+        stage_name = stage.lower()
+        names = {'#at': f"{stage_name}_at", '#version': f"{stage_name}_version", '#ttl': 'ttl'}
+        values = {
+            ':at': {'S': _now()},
+            ':version': {'S': str(version)},
+            ':ttl': {'N': str(int(time.time()) + TIME_TO_LIVE_DAYS * 86400)}
+        }
+        update = 'SET #at = :at, #version = :version, #ttl = :ttl'
+        if output is not None and len(output.encode('utf-8')) <= MAX_OUTPUT_BYTES:
+            names['#output'] = f"{stage_name}_output"
+            values[':output'] = {'S': output}
+            update += ', #output = :output'
+
+        try:
+            self.ddb.update_item(
+                TableName=self.table_name,
+                Key=self._checkpoint_key(),
+                UpdateExpression=update,
+                ConditionExpression='attribute_not_exists(#at) OR #version <> :version',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.warning(f"Checkpoint of {stage} failed for {self.uid}: {e}")
+        self.stage_done(stage)
+
+    def stage_done(self, stage):
+        """
+        Add stage to the stages set of the document, unless the document is DONE. Stages that
+        finish in any order all stay recorded.
+        """
+        if self.ddb is None:
+            return False
+        updated_at = _now()
+        try:
+            self.ddb.update_item(
+                TableName=self.table_name,
+                Key={'s3_path': {'S': self.uid}},
+                UpdateExpression='ADD stages :stage SET updated_at = :updated_at, pending_key = :pending_key, '
+                                 '#status = if_not_exists(#status, :ingested), '
+                                 'status_rank = if_not_exists(status_rank, :ingested_rank), #ttl = if_not_exists(#ttl, :ttl)',
+                ConditionExpression='attribute_not_exists(status_rank) OR status_rank < :done_rank',
+                ExpressionAttributeNames={'#status': 'status', '#ttl': 'ttl'},
+                ExpressionAttributeValues={
+                    ':stage': {'SS': [stage]},
+                    ':updated_at': {'S': updated_at},
+                    # The status is INGESTED until the document is DONE
+                    ':pending_key': {'S': f"{INGESTED}#{updated_at[:10]}"},
+                    ':ingested': {'S': INGESTED},
+                    ':ingested_rank': {'N': str(STATUS_RANK[INGESTED])},
+                    ':done_rank': {'N': str(STATUS_RANK[DONE])},
+                    ':ttl': {'N': str(int(time.time()) + TIME_TO_LIVE_DAYS * 86400)}
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.warning(f"Recording {stage} failed for {self.uid}: {e}")
+            return False
+        logger.info(f"{stage} of {self.uid} done")
+        return True
+
+    def advance(self, status, **attributes):
+        """
+        Move the document to status unless it is already at or past it. DONE documents leave the
+        incomplete documents index for the completed documents index, which compact_results reads
+        by day. attributes are string attributes set along with the status, such as result_key.
+        """
+        if self.ddb is None:
+            return False
+        updated_at = _now()
+        names = {'#status': 'status', '#ttl': 'ttl'}
+        values = {
+            ':status': {'S': status},
+            ':rank': {'N': str(STATUS_RANK[status])},
+            ':updated_at': {'S': updated_at},
+            ':ttl': {'N': str(int(time.time()) + TIME_TO_LIVE_DAYS * 86400)}
+        }
+        update = 'SET #status = :status, status_rank = :rank, updated_at = :updated_at, #ttl = if_not_exists(#ttl, :ttl)'
+        for index, (name, value) in enumerate(attributes.items()):
+            names[f"#a{index}"] = name
+            values[f":a{index}"] = {'S': value}
+            update += f", #a{index} = :a{index}"
+        # Sparse indexes, only documents with a pending_key or a completed_day are in them. Both are
+        # keyed by day, so the writes of a run are not all on one index partition.
+        if status == DONE:
+            values[':completed_day'] = {'S': updated_at[:10]}
+            update += ', completed_day = :completed_day REMOVE pending_key'
+        else:
+            values[':pending_key'] = {'S': f"{status}#{updated_at[:10]}"}
+            update += ', pending_key = :pending_key'
+
+        try:
+            self.ddb.update_item(
+                TableName=self.table_name,
+                Key={'s3_path': {'S': self.uid}},
+                UpdateExpression=update,
+                ConditionExpression='attribute_not_exists(status_rank) OR status_rank < :rank',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.warning(f"Status update to {status} failed for {self.uid}: {e}")
+            return False
+        logger.info(f"{self.uid} is {status}")
+        return True
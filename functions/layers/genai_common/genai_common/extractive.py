@@ -0,0 +1,419 @@
+import functools
+import logging
+import multiprocessing
+import os
+import re
+import time
+from multiprocessing.connection import wait
+
+import nltk
+import numpy as np
+from scipy import sparse
+from sumy.parsers.plaintext import PlaintextParser
+from sumy.nlp.tokenizers import Tokenizer
+from sumy.nlp.stemmers import Stemmer
+from sumy.utils import get_stop_words
+
+# sumy, nltk, numpy and scipy are installed by the functions that import this module
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+nltk_data_path = os.path.join(os.getcwd(), 'nltk_data')
+
+SENTENCES_COUNT = 10
+# "numpy" uses the vectorized TextRank below, "sumy" the reference TextRankSummarizer
+TEXTRANK_ENGINE = os.environ.get('TEXTRANK_ENGINE', 'numpy')
+TEXTRANK_DAMPING = 0.85
+TEXTRANK_EPSILON = 1e-4
+# Same constant as sumy to prevent zero division for sentences without words
+ZERO_DIVISION_PREVENTION = 1e-7
+# Upper bound of the summarization time budget, further limited by the remaining Lambda time
+SUMMARY_TIMEOUT_SECONDS = int(os.environ.get('SUMMARY_TIMEOUT_SECONDS', 600))
+# Lambda time kept aside for the Luhn fallback and the S3 upload
+RESERVED_SECONDS = int(os.environ.get('RESERVED_SECONDS', 60))
+# Extracts larger than this are streamed and summarized chunk by chunk (map-reduce)
+CHUNKED_MIN_BYTES = int(os.environ.get('CHUNKED_MIN_BYTES', 2_000_000))
+# Size of the sentence aligned windows and number of sentences kept from each of them
+CHUNK_CHARS = int(os.environ.get('CHUNK_CHARS', 100_000))
+CHUNK_SENTENCES_COUNT = int(os.environ.get('CHUNK_SENTENCES_COUNT', 3 * SENTENCES_COUNT))
+SENTENCE_BOUNDARY = re.compile(r'[.!?]["\')\]]*\s+|\n\s*\n')
+# Lambda allocates CPU in proportion to memory, one vCPU per 1,769 MB. os.cpu_count() reports the
+# vCPUs of the host, also when the function gets a fraction of one
+MB_PER_VCPU = 1769
+
+
+def _vcpus():
+    memory_mb = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if memory_mb:
+        return max(1, int(memory_mb) // MB_PER_VCPU)
+    return os.cpu_count() or 1
+
+
+# Forked chunk workers, one per whole vCPU. With one, the chunks are summarized in process
+CHUNK_WORKERS = int(os.environ.get('CHUNK_WORKERS', _vcpus()))
+
+_nltk_ready = False
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when TextRank runs out of its time budget before producing any ranking
+    """
+
+
+def _check_deadline(deadline):
+    if deadline is not None and time.monotonic() > deadline:
+        raise DeadlineExceeded()
+
+
+def init_nltk():
+    global _nltk_ready
+    if _nltk_ready:
+        return
+
+    try:
+        # Data packaged with the function code, otherwise NLTK_DATA or the default paths are searched
+        if os.path.isdir(nltk_data_path) and nltk_data_path not in nltk.data.path:
+            logger.info(f"NLTK files in {nltk_data_path}: {os.listdir(nltk_data_path)}")
+            nltk.data.path.append(nltk_data_path)
+        nltk.data.find('tokenizers/punkt')
+        _nltk_ready = True
+        logger.info("NLTK data found successfully")
+    except LookupError as e:
+        logger.error(f"NLTK data not found: {str(e)}")
+        raise
+
+
+@functools.lru_cache(maxsize=None)
+def get_nlp_resources():
+    """
+    Tokenizer (which loads the punkt model), stemmer and stop words, built once per container
+    """
+    return Tokenizer("english"), Stemmer("english"), get_stop_words("english")
+
+
+def sentence_term_matrix(sentences, stemmer, stop_words, deadline=None):
+    """
+    Build the sparse sentence x term count matrix of the stemmed, stop word filtered
+    words of each sentence, along with the number of such words per sentence.
+    Raises DeadlineExceeded once deadline (a time.monotonic() value) has passed.
+    """
+    vocabulary = {}
+    stems = {}
+    rows = []
+    cols = []
+    lengths = np.zeros(len(sentences))
+
+    for index, sentence in enumerate(sentences):
+        if index % 256 == 0:
+            _check_deadline(deadline)
+
+        start = len(cols)
+        for word in sentence.words:
+            word = word.lower()
+            if word in stop_words:
+                continue
+
+            stem = stems.get(word)
+            if stem is None:
+                stem = stems[word] = stemmer(word)
+            rows.append(index)
+            cols.append(vocabulary.setdefault(stem, len(vocabulary)))
+
+        lengths[index] = len(cols) - start
+
+    # Duplicate (row, col) pairs are summed into word counts
+    counts = sparse.csr_matrix(
+        (np.ones(len(cols)), (rows, cols)),
+        shape=(len(sentences), len(vocabulary))
+    )
+    return counts, lengths
+
+
+def textrank_scores(counts, lengths, damping=TEXTRANK_DAMPING, epsilon=TEXTRANK_EPSILON, deadline=None):
+    """
+    Vectorized equivalent of sumy's TextRankSummarizer.rate_sentences. The similarity of two
+    sentences is the number of common words divided by the sum of the logs of their lengths,
+    computed for every pair at once as a sparse matrix product.
+    When deadline passes during the power method, the current approximation is returned.
+    """
+    sentences_count = counts.shape[0]
+
+    common_words = (counts @ counts.T).tocoo()
+    log_lengths = np.log(np.maximum(lengths, 1))
+    norm = log_lengths[common_words.row] + log_lengths[common_words.col]
+    # Both sentences have a single word when the norm is 0
+    single_words = np.isclose(norm, 0.)
+    similarity = np.where(single_words, common_words.data, common_words.data / np.where(single_words, 1., norm))
+
+    weights = sparse.csr_matrix(
+        (similarity, (common_words.row, common_words.col)),
+        shape=(sentences_count, sentences_count)
+    )
+    row_sums = np.asarray(weights.sum(axis=1)).ravel()
+    weights = sparse.diags(1. / (row_sums + ZERO_DIVISION_PREVENTION)) @ weights
+    transposed = (damping * weights).T.tocsr()
+
+    # Power method on damping * weights + (1 - damping) / n without materializing the dense matrix
+    p_vector = np.full(sentences_count, 1.0 / sentences_count)
+    lambda_val = 1.0
+    while lambda_val > epsilon:
+        next_p = transposed @ p_vector + (1. - damping) / sentences_count * p_vector.sum()
+        lambda_val = np.linalg.norm(next_p - p_vector)
+        p_vector = next_p
+
+        if lambda_val > epsilon and deadline is not None and time.monotonic() > deadline:
+            logger.warning(f"Deadline reached before convergence, using ranks at delta {lambda_val}")
+            break
+
+    return p_vector
+
+
+def textrank(sentences, stemmer, stop_words, sentences_count, deadline=None):
+    """
+    Return the sentences_count best rated sentences in document order.
+    """
+    if not sentences:
+        return ()
+
+    counts, lengths = sentence_term_matrix(sentences, stemmer, stop_words, deadline=deadline)
+    _check_deadline(deadline)
+    ranks = textrank_scores(counts, lengths, deadline=deadline)
+
+    # Stable sort keeps document order between equally rated sentences, like sumy
+    best = np.sort(np.argsort(-ranks, kind='stable')[:sentences_count])
+    return tuple(sentences[index] for index in best)
+
+
+def parse_document(text):
+    """
+    Split text into sentences once. Words are tokenized lazily and cached on each
+    sentence, so TextRank and the Luhn fallback share the same tokenization.
+    """
+    tokenizer, _, _ = get_nlp_resources()
+    return PlaintextParser.from_string(text, tokenizer).document
+
+
+def _sumy_summarizer(stemmer, stop_words):
+    from sumy.summarizers.text_rank import TextRankSummarizer
+
+    summarizer = TextRankSummarizer(stemmer)
+    summarizer.stop_words = stop_words
+    return summarizer
+
+
+def _sumy_worker(connection, document, stemmer, stop_words, sentences_count):
+    summary = _sumy_summarizer(stemmer, stop_words)(document, sentences_count)
+    # Sentences are sent back by position, the forked parent holds the same document
+    positions = {id(sentence): index for index, sentence in enumerate(document.sentences)}
+    connection.send([positions[id(sentence)] for sentence in summary])
+    connection.close()
+
+
+def _sumy_textrank(document, stemmer, stop_words, sentences_count, deadline=None):
+    """
+    Reference sumy TextRankSummarizer. It cannot be interrupted, so with a deadline it runs
+    in a forked process that is terminated when the deadline passes.
+    """
+    if deadline is None:
+        return _sumy_summarizer(stemmer, stop_words)(document, sentences_count)
+
+    fork = multiprocessing.get_context('fork')
+    connection, child_connection = fork.Pipe(duplex=False)
+    process = fork.Process(target=_sumy_worker,
+                           args=(child_connection, document, stemmer, stop_words, sentences_count))
+    process.start()
+    child_connection.close()
+
+    try:
+        if not connection.poll(max(deadline - time.monotonic(), 0)):
+            raise DeadlineExceeded()
+        positions = connection.recv()
+    finally:
+        connection.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+    sentences = document.sentences
+    return tuple(sentences[index] for index in positions)
+
+
+def summarize_document(document, SENTENCES_COUNT=SENTENCES_COUNT, deadline=None, separator=""):
+    _, stemmer, stop_words = get_nlp_resources()
+
+    if TEXTRANK_ENGINE == "sumy":
+        summary = _sumy_textrank(document, stemmer, stop_words, SENTENCES_COUNT, deadline=deadline)
+    else:
+        summary = textrank(document.sentences, stemmer, stop_words, SENTENCES_COUNT, deadline=deadline)
+
+    return separator.join(str(sentence) for sentence in summary)
+
+
+def summarize_text(text, SENTENCES_COUNT=SENTENCES_COUNT):
+    return summarize_document(parse_document(text), SENTENCES_COUNT=SENTENCES_COUNT)
+
+
+def luhn_summarize_document(document, SENTENCES_COUNT=SENTENCES_COUNT):
+    # Only needed on the fallback path, so not imported at cold start
+    from sumy.summarizers.luhn import LuhnSummarizer
+
+    summarizer = LuhnSummarizer()
+    summary = summarizer(document, SENTENCES_COUNT)
+    summary_sentences = [str(sentence) for sentence in summary]
+    return " ".join(summary_sentences)
+
+
+def luhn_summarization(text, SENTENCES_COUNT=SENTENCES_COUNT):
+    logger.info("Switching to Luhn summarization for time optimization.")
+    return luhn_summarize_document(parse_document(text), SENTENCES_COUNT=SENTENCES_COUNT)
+
+
+def _deadline(timeout, context=None):
+    if context is not None:
+        timeout = min(timeout, context.get_remaining_time_in_millis() / 1000 - RESERVED_SECONDS)
+    return time.monotonic() + max(timeout, 0)
+
+
+def _summarize_with_fallback(text, sentences_count, deadline, separator=""):
+    document = parse_document(text)
+    try:
+        return summarize_document(document, SENTENCES_COUNT=sentences_count, deadline=deadline, separator=separator)
+    except DeadlineExceeded:
+        logger.warning("Time exceeded, switching to Luhn summarization.")
+        return luhn_summarize_document(document, SENTENCES_COUNT=sentences_count)
+
+
+def ext_summary_with_timeout(text, SENTENCES_COUNT=SENTENCES_COUNT, timeout=SUMMARY_TIMEOUT_SECONDS, context=None):
+    """
+    Summarize with TextRank within a hard time budget of timeout seconds, limited to the
+    remaining Lambda time minus RESERVED_SECONDS when context is given. If TextRank cannot
+    rank the sentences in time, fall back to Luhn on the already parsed document.
+    """
+    deadline = _deadline(timeout, context)
+    return _summarize_with_fallback(text, SENTENCES_COUNT, deadline) or "No summary generated."
+
+
+def _window_end(text, limit):
+    """
+    Index of the last sentence boundary before limit, or of the last whitespace when
+    the window holds no boundary in its second half.
+    """
+    end = 0
+    for match in SENTENCE_BOUNDARY.finditer(text, 0, limit):
+        end = match.end()
+
+    if end < limit // 2:
+        end = text.rfind(' ', limit // 2, limit) + 1 or limit
+    return end
+
+
+def iter_sentence_windows(pieces, window_chars=CHUNK_CHARS):
+    """
+    Regroup a stream of text pieces into windows of at most window_chars characters
+    that end on sentence boundaries.
+    """
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= window_chars:
+            end = _window_end(buffer, window_chars)
+            yield buffer[:end]
+            buffer = buffer[end:]
+
+    if buffer.strip():
+        yield buffer
+
+
+def _chunk_worker(connection, sentences_count, deadline):
+    while True:
+        chunk = connection.recv()
+        if chunk is None:
+            break
+        connection.send(_summarize_with_fallback(chunk, sentences_count, deadline, separator=" "))
+    connection.close()
+
+
+def map_chunks(chunks, sentences_count, deadline, workers=CHUNK_WORKERS):
+    """
+    Summarize each chunk down to sentences_count sentences on up to workers forked
+    processes, holding at most one chunk per worker in memory. Returns the summaries in
+    chunk order. Lambda has no /dev/shm, so plain Processes and Pipes are used instead of
+    a multiprocessing Pool.
+    """
+    if workers <= 1:
+        return [_summarize_with_fallback(chunk, sentences_count, deadline, separator=" ") for chunk in chunks]
+
+    fork = multiprocessing.get_context('fork')
+    processes = []
+    idle = []
+    busy = {}
+    results = {}
+    chunks = enumerate(chunks)
+    exhausted = False
+
+    try:
+        for _ in range(workers):
+            connection, child_connection = fork.Pipe()
+            # Not daemonic, so the sumy engine can fork its own worker. They are stopped below.
+            process = fork.Process(target=_chunk_worker, args=(child_connection, sentences_count, deadline))
+            process.start()
+            child_connection.close()
+            processes.append((process, connection))
+            idle.append(connection)
+
+        while True:
+            while idle and not exhausted:
+                index, chunk = next(chunks, (None, None))
+                if index is None:
+                    exhausted = True
+                    break
+                connection = idle.pop()
+                connection.send(chunk)
+                busy[connection] = index
+
+            if not busy:
+                break
+
+            for connection in wait(list(busy)):
+                results[busy.pop(connection)] = connection.recv()
+                idle.append(connection)
+
+    finally:
+        for process, connection in processes:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+    return [results[index] for index in sorted(results)]
+
+
+def chunked_summary(pieces, SENTENCES_COUNT=SENTENCES_COUNT, timeout=SUMMARY_TIMEOUT_SECONDS, context=None):
+    """
+    Hierarchical map-reduce summarization of a stream of text pieces. Sentence aligned
+    windows are summarized in parallel, then the chunk summaries are summarized again until
+    they fit in one window, which is summarized down to SENTENCES_COUNT sentences.
+    """
+    deadline = _deadline(timeout, context)
+
+    summaries = map_chunks(iter_sentence_windows(pieces), CHUNK_SENTENCES_COUNT, deadline)
+    level = 1
+    while sum(len(summary) + 1 for summary in summaries) > CHUNK_CHARS:
+        logger.info(f"Reducing {len(summaries)} chunk summaries at level {level}")
+        reduced = map_chunks(
+            iter_sentence_windows(summary + " " for summary in summaries),
+            CHUNK_SENTENCES_COUNT,
+            deadline
+        )
+        if len(reduced) >= len(summaries):
+            break
+        summaries = reduced
+        level += 1
+
+    return _summarize_with_fallback(" ".join(summaries), SENTENCES_COUNT, deadline) or "No summary generated."
@@ -0,0 +1,36 @@
+import logging
+import os
+
+from genai_common.llm_response import generation_payload, parse_generation
+from genai_common.prompt_builder import build_prompt
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Prompt sizes in tokens, the endpoint accepts up to MAX_INPUT_LENGTH (16000) with 18000 batch prefill tokens
+TITLE_MAX_INPUT_TOKENS = int(os.environ.get('TITLE_MAX_INPUT_TOKENS', 2048))
+ABSTRACT_MAX_INPUT_TOKENS = int(os.environ.get('ABSTRACT_MAX_INPUT_TOKENS', 8192))
+
+TITLE_PROMPT_TEMPLATE = '<s>[INST] <<SYS>>\nYou are a robot that generates a title given some text. You only provide the title and nothing else. Generate a title given the following text:\n<</SYS>>\n\n{text} [/INST]'
+ABSTRACT_PROMPT_TEMPLATE = '<s>[INST] <<SYS>>\nWrite an abstract given the following text\n<</SYS>>\n\n{text} [/INST]'
+
+# Bump a prompt version when its prompt or the parsing of responses changes, to stop serving old cached results
+TITLE_PROMPT_VERSION = 1
+ABSTRACT_PROMPT_VERSION = 1
+
+
+def generate(client, template, text, max_input_tokens, max_new_tokens=512, top_p=0.1, temperature=0.1):
+    """
+    Fill template with text up to max_input_tokens and return the text generated by the LLM.
+    client is an InferenceClient or an InferenceCache.
+    """
+    prompt = build_prompt(template, text, max_input_tokens)
+    logger.info(f"input_tokens: {prompt.input_tokens}, truncated: {prompt.truncated}")
+
+    payload = generation_payload(prompt.inputs, max_new_tokens=max_new_tokens, top_p=top_p, temperature=temperature)
+    response = client.invoke(payload)
+    logger.info(f"latency_ms: {response.latency_ms}, attempts: {response.attempts}, cached: {response.cached}")
+
+    generation = parse_generation(response.body, inputs=prompt.inputs)
+    logger.info(f"response_bytes: {generation.response_bytes}, generated_tokens: {generation.generated_tokens}")
+    return generation.text
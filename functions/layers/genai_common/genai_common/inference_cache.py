@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import os
+import time
+
+import boto3
+from aws_lambda_powertools.metrics import MetricUnit, single_metric
+from botocore.exceptions import ClientError
+
+from genai_common.inference_client import InferenceResponse
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CACHE_TABLE = os.environ.get('INFERENCE_CACHE_TABLE', '')
+CACHE_TTL_DAYS = int(os.environ.get('INFERENCE_CACHE_TTL_DAYS', 30))
+# Bodies larger than MAX_ITEM_BODY_BYTES are kept in S3 under this prefix, and not cached without a bucket
+CACHE_BUCKET = os.environ.get('INFERENCE_CACHE_BUCKET', '')
+CACHE_BUCKET_PREFIX = os.environ.get('INFERENCE_CACHE_PREFIX', 'inference-cache/')
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'GenAiStateMachine')
+
+# Cache items share the document state table, so their keys are kept apart with a prefix
+CACHE_KEY_PREFIX = "cache#"
+# Keeps a cache item within a few capacity units of the state table
+MAX_ITEM_BODY_BYTES = int(os.environ.get('INFERENCE_CACHE_MAX_ITEM_BODY_BYTES', 4_000))
+
+
+class InferenceCache:
+    """
+    Content addressed cache of endpoint responses in front of an InferenceClient. Responses are
+    keyed by a hash of the model, task, prompt template version and request body (which holds
+    the input text and generation parameters), stored in DynamoDB and evicted by TTL. Large
+    bodies are stored in S3 and referenced from the item, the bucket expires them by lifecycle.
+    Cache errors are logged and the endpoint is invoked as if there was no cache.
+    """
+    def __init__(self, client, model_name, task, prompt_version, table_name=CACHE_TABLE, ttl_days=CACHE_TTL_DAYS,
+                 bucket=CACHE_BUCKET, bucket_prefix=CACHE_BUCKET_PREFIX):
+        self.client = client
+        self.model_name = model_name
+        self.task = task
+        self.prompt_version = str(prompt_version)
+        self.table_name = table_name
+        self.ttl_days = ttl_days
+        self.bucket = bucket
+        self.bucket_prefix = bucket_prefix
+        self.ddb = boto3.client('dynamodb') if table_name else None
+        self.s3 = boto3.client('s3') if table_name and bucket else None
+
+    def key(self, body):
+        digest = hashlib.sha256()
+        for part in (self.model_name, self.task, self.prompt_version):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        digest.update(body.encode('utf-8') if isinstance(body, str) else body)
+        return f"{CACHE_KEY_PREFIX}{digest.hexdigest()}"
+
+    def _get(self, key):
+        try:
+            item = self.ddb.get_item(
+                TableName=self.table_name,
+                Key={'s3_path': {'S': key}},
+                ProjectionExpression='#body, body_key, latency_ms, #ttl',
+                ExpressionAttributeNames={'#body': 'body', '#ttl': 'ttl'}
+            ).get('Item')
+        except ClientError as e:
+            logger.warning(f"Inference cache read failed: {e}")
+            return None
+
+        # TTL deletes run in the background, expired items can still be read for a while
+        if not item or int(item['ttl']['N']) < time.time():
+            return None
+        if 'body' in item:
+            return item['body']['B'], float(item['latency_ms']['N'])
+        if self.s3 is None:
+            return None
+
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=item['body_key']['S'])['Body'].read()
+        except ClientError as e:
+            # Expired by the bucket lifecycle before the item
+            logger.warning(f"Inference cache body read failed: {e}")
+            return None
+        return body, float(item['latency_ms']['N'])
+
+    def _put(self, key, response):
+        item = {
+            's3_path': {'S': key},
+            'latency_ms': {'N': str(response.latency_ms)},
+            'task': {'S': self.task},
+            'ttl': {'N': str(int(time.time()) + self.ttl_days * 86400)}
+        }
+        try:
+            if len(response.body) <= MAX_ITEM_BODY_BYTES:
+                item['body'] = {'B': response.body}
+            elif self.s3 is not None:
+                body_key = f"{self.bucket_prefix}{key[len(CACHE_KEY_PREFIX):]}"
+                self.s3.put_object(Bucket=self.bucket, Key=body_key, Body=response.body)
+                item['body_key'] = {'S': body_key}
+            else:
+                logger.info(f"Response of {len(response.body)} bytes is too large to cache without a bucket")
+                return
+
+            self.ddb.put_item(TableName=self.table_name, Item=item)
+        except ClientError as e:
+            logger.warning(f"Inference cache write failed: {e}")
+
+    def _emit_metrics(self, hit, saved_ms):
+        # One EMF line per metric, single metrics do not share dimensions with the concurrent tasks
+        for name, unit, value in (
+            ('InferenceCacheHit', MetricUnit.Count, int(hit)),
+            ('InferenceCacheMiss', MetricUnit.Count, int(not hit)),
+            ('InferenceTimeSaved', MetricUnit.Milliseconds, saved_ms)
+        ):
+            with single_metric(name=name, unit=unit, value=value, namespace=METRICS_NAMESPACE) as metric:
+                metric.add_dimension(name='Task', value=self.task)
+
+    def invoke(self, body, content_type='application/json'):
+        """
+        Return the cached response for body, or invoke the endpoint and cache its response.
+        Cached responses carry the latency of the call that produced them and zero attempts.
+        """
+        if self.ddb is None:
+            return self.client.invoke(body, content_type)
+
+        key = self.key(body)
+        cached = self._get(key)
+        if cached:
+            body, latency_ms = cached
+            logger.info(f"Inference cache hit for {self.task}, {latency_ms} ms of endpoint time saved")
+            self._emit_metrics(True, latency_ms)
+            return InferenceResponse(body, latency_ms, 0, True)
+
+        response = self.client.invoke(body, content_type)
+        self._put(key, response)
+        self._emit_metrics(False, 0)
+        return response
@@ -0,0 +1,175 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MAX_POOL_CONNECTIONS = int(os.environ.get('INFERENCE_MAX_POOL_CONNECTIONS', 10))
+MAX_ATTEMPTS = int(os.environ.get('INFERENCE_MAX_ATTEMPTS', 6))
+BASE_RETRY_DELAY = float(os.environ.get('INFERENCE_BASE_RETRY_DELAY', 0.2))
+MAX_RETRY_DELAY = float(os.environ.get('INFERENCE_MAX_RETRY_DELAY', 5))
+# Requests per second allowed by the rate limiter once a throttle has been seen
+MIN_RATE = float(os.environ.get('INFERENCE_MIN_RATE', 0.5))
+MAX_RATE = float(os.environ.get('INFERENCE_MAX_RATE', 50))
+# SageMaker real-time inference times out after 60 seconds
+READ_TIMEOUT = int(os.environ.get('INFERENCE_READ_TIMEOUT', 70))
+
+THROTTLING_CODES = {'ThrottlingException', 'TooManyRequestsException', 'Throttling', 'RequestLimitExceeded'}
+RETRYABLE_CODES = {'ServiceUnavailable', 'InternalFailure', 'InternalServerError', 'ModelNotReadyException'}
+# Raised by the SDK before any response, typically when the endpoint is saturated
+CONNECTION_ERRORS = (ReadTimeoutError, ConnectTimeoutError, EndpointConnectionError, ConnectionClosedError)
+
+InferenceResponse = namedtuple('InferenceResponse', ['body', 'latency_ms', 'attempts', 'cached'], defaults=(False,))
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose fill rate is cut multiplicatively on throttling responses and
+    raised additively on successes. It lets requests through unthrottled until the
+    first throttling response.
+    The bucket only sees the calls of its own container, so it is a per-container backoff:
+    it does not limit the total request rate of the concurrent Lambda containers calling
+    the endpoint, which is bounded by the state machine concurrency and the endpoint capacity.
+    """
+    def __init__(self, min_rate=MIN_RATE, max_rate=MAX_RATE, backoff=0.5, increase=0.5):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.backoff = backoff
+        self.increase = increase
+        self.rate = None
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if self.rate is None:
+                    return
+
+                now = time.monotonic()
+                self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def on_throttle(self, observed_rate):
+        with self.lock:
+            current = self.rate if self.rate is not None else max(observed_rate, self.min_rate)
+            self.rate = max(self.min_rate, current * self.backoff)
+            self.tokens = min(self.tokens, 0.0)
+            logger.warning(f"Throttled, request rate limited to {self.rate:.2f}/s")
+
+    def on_success(self):
+        with self.lock:
+            if self.rate is not None:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class InferenceClient:
+    """
+    SageMaker runtime client shared by the genai functions. It keeps connections alive in a
+    pool, backs off the calls of this container when the endpoint throttles, retries throttles,
+    server errors, timeouts and connection errors with jittered exponential backoff, and captures
+    the latency of every call. One client is shared by the threads of a container, its counters
+    are updated under a lock.
+    """
+    def __init__(self, endpoint_name, max_attempts=MAX_ATTEMPTS, rate_limiter=None):
+        self.endpoint_name = endpoint_name
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        # Retries are handled here, so the SDK only makes one attempt per call
+        self.client = boto3.client(
+            'sagemaker-runtime',
+            config=Config(
+                max_pool_connections=MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                read_timeout=READ_TIMEOUT,
+                retries={'total_max_attempts': 1, 'mode': 'standard'}
+            )
+        )
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _count(self, calls=0, throttles=0, retries=0):
+        with self.lock:
+            self.calls += calls
+            self.throttles += throttles
+            self.retries += retries
+
+    def _observed_rate(self):
+        with self.lock:
+            calls = self.calls
+        return calls / max(time.monotonic() - self.started, 1.0)
+
+    def invoke(self, body, content_type='application/json'):
+        """
+        Invoke the endpoint and return an InferenceResponse with the response body bytes,
+        the latency of the successful attempt and the number of attempts.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = self.client.invoke_endpoint(
+                    EndpointName=self.endpoint_name,
+                    Body=body,
+                    ContentType=content_type
+                )
+                response_body = response['Body'].read()
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+                self._count(calls=1)
+
+                if code in THROTTLING_CODES or status == 429:
+                    self._count(throttles=1)
+                    self.rate_limiter.on_throttle(self._observed_rate())
+                elif code not in RETRYABLE_CODES and status < 500:
+                    raise
+
+                if attempt == self.max_attempts:
+                    raise
+                self._retry(attempt, f"returned {code} ({status})")
+                continue
+            except CONNECTION_ERRORS as e:
+                self._count(calls=1)
+                if attempt == self.max_attempts:
+                    raise
+                self._retry(attempt, f"failed: {e}")
+                continue
+
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            self._count(calls=1)
+            self.rate_limiter.on_success()
+            logger.info(f"{self.endpoint_name} latency_ms: {latency_ms}, attempts: {attempt}")
+            return InferenceResponse(response_body, latency_ms, attempt)
+
+    def _retry(self, attempt, reason):
+        # Full jitter keeps retries from many concurrent callers apart
+        delay = random.uniform(0, min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2 ** (attempt - 1)))
+        logger.warning(f"{self.endpoint_name} {reason}, "
+                       f"retrying in {delay:.2f}s (attempt {attempt}/{self.max_attempts})")
+        self._count(retries=1)
+        time.sleep(delay)
@@ -0,0 +1,68 @@
+import json
+import os
+from collections import namedtuple
+
+# Ask TGI for generation details, which add a per token list to the response but give exact token counts
+RESPONSE_DETAILS = os.environ.get('LLM_RESPONSE_DETAILS', 'False').lower() == 'true'
+
+GenerationResult = namedtuple('GenerationResult', ['text', 'generated_tokens', 'finish_reason', 'response_bytes'])
+
+
+class LLMResponseError(ValueError):
+    """
+    Raised when the endpoint response is not a TGI generation
+    """
+
+
+def generation_payload(inputs, max_new_tokens=512, top_p=0.1, temperature=0.1, details=RESPONSE_DETAILS):
+    """
+    TGI request body that only returns the generated text, not the prompt
+    """
+    return json.dumps(
+        {
+            "inputs": inputs,
+            "parameters": {
+                "max_new_tokens": max_new_tokens,
+                "top_p": top_p,
+                "temperature": temperature,
+                "return_full_text": False,
+                "details": details
+            }
+        }
+    )
+
+
+def parse_generation(body, inputs=None):
+    """
+    Parse a TGI response body ([{"generated_text": ...}] or {"generated_text": ...}).
+    If the server still echoed the prompt, it is removed when the text starts with inputs.
+    """
+    try:
+        response = json.loads(body)
+    except ValueError as e:
+        raise LLMResponseError(f"Response is not JSON: {body[:200]!r}") from e
+
+    if isinstance(response, list):
+        if not response:
+            raise LLMResponseError("Empty response")
+        response = response[0]
+
+    if not isinstance(response, dict):
+        raise LLMResponseError(f"Unexpected response type: {type(response).__name__}")
+    if 'error' in response:
+        raise LLMResponseError(f"Endpoint error: {response.get('error_type')}: {response['error']}")
+
+    text = response.get('generated_text')
+    if not isinstance(text, str):
+        raise LLMResponseError(f"Response has no generated_text: {list(response)}")
+
+    if inputs and text.startswith(inputs):
+        text = text[len(inputs):]
+
+    details = response.get('details') or {}
+    return GenerationResult(
+        text=text,
+        generated_tokens=details.get('generated_tokens'),
+        finish_reason=details.get('finish_reason'),
+        response_bytes=len(body)
+    )
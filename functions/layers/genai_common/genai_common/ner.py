@@ -0,0 +1,87 @@
+import ast
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Estimated first page of the document, where authors are named
+FIRST_PAGE_CHARS = 1_500
+# Tokens scored below this are not part of a name
+MIN_SCORE = float(os.environ.get('NER_MIN_SCORE', 0.5))
+# Bump when the parsing of responses changes, to stop serving old cached results
+NER_PROMPT_VERSION = 3
+
+PERSON_ENTITIES = {'B-PER', 'I-PER', 'PER'}
+# Left around a name sliced from the text, such as the comma before the next author
+NAME_STRIP = " \t\r\n.,;:"
+
+
+def _decode_names(ner_results, text, min_score):
+    """
+    Names of the person spans, sliced from text by the start and end offsets of their tokens.
+    One pass: a B-PER token starts a span unless it is a word piece of the previous token, I-PER
+    tokens extend it, and any other entity or a token scored below min_score ends it. Only tokens
+    separated from the span by nothing but whitespace extend it, so an I-PER after a comma or
+    other text starts a new name.
+    """
+    spans = []
+    start = end = None
+    for result in ner_results:
+        entity = result.get('entity') or result.get('entity_group')
+        if entity not in PERSON_ENTITIES or float(result['score']) < min_score:
+            if start is not None:
+                spans.append((start, end))
+                start = None
+            continue
+
+        continues = start is not None and not text[end:result['start']].strip() and (
+            entity == 'I-PER' or result['start'] == end or result.get('word', '').startswith('##')
+        )
+        if continues:
+            end = result['end']
+        else:
+            if start is not None:
+                spans.append((start, end))
+            start, end = result['start'], result['end']
+
+    if start is not None:
+        spans.append((start, end))
+
+    # dict keeps the first occurrence of each name in document order
+    names = dict.fromkeys(" ".join(text[start:end].split()).strip(NAME_STRIP) for start, end in spans)
+    names.pop("", None)
+    return list(names)
+
+
+def get_names(ner_results, text, min_score=MIN_SCORE):
+    """
+    Distinct person names in the Hugging Face token classification results for text, in order of
+    appearance. Results need the start and end offsets of each token, which the pipeline returns
+    for fast tokenizers.
+    """
+    names = _decode_names(ner_results, text, min_score)
+    logger.info(f"tokens: {len(ner_results)}, names: {len(names)}")
+    return names
+
+
+def extract_authors(client, text, min_score=MIN_SCORE):
+    """
+    Run NER on the first page of text and return the person names found, one per line.
+    client is an InferenceClient or an InferenceCache.
+    """
+    first_page = text[:FIRST_PAGE_CHARS]
+    payload = json.dumps({"inputs": first_page})
+
+    response = client.invoke(payload)
+    logger.info(f"latency_ms: {response.latency_ms}, attempts: {response.attempts}, cached: {response.cached}")
+
+    body = response.body.decode('utf-8')
+    try:
+        ner_results = json.loads(body)
+    except ValueError:
+        ner_results = ast.literal_eval(body)
+
+    names = get_names(ner_results, first_page, min_score) if ner_results else []
+    return "".join(name + "\n" for name in names)
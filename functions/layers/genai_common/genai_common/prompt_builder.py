@@ -0,0 +1,97 @@
+import functools
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# tokenizer.json of the endpoint model, shipped in the tokenizer data layer which Lambda extracts to /opt
+TOKENIZER_PATH = os.environ.get('TOKENIZER_PATH', '/opt/tokenizer/tokenizer.json')
+# Used to size S3 reads, and to budget prompts when no tokenizer file is available
+MAX_CHARS_PER_TOKEN = int(os.environ.get('MAX_CHARS_PER_TOKEN', 6))
+FALLBACK_CHARS_PER_TOKEN = float(os.environ.get('FALLBACK_CHARS_PER_TOKEN', 3))
+
+SENTENCE_END = re.compile(r'[.!?]["\')\]]*\s+')
+
+Prompt = namedtuple('Prompt', ['inputs', 'input_tokens', 'truncated'])
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(path=TOKENIZER_PATH):
+    """
+    Load the tokenizer once per container, None if it is not available
+    """
+    try:
+        from tokenizers import Tokenizer
+        return Tokenizer.from_file(path)
+    except Exception as e:
+        logger.warning(f"Tokenizer not loaded from {path}, estimating {FALLBACK_CHARS_PER_TOKEN} chars per token: {e}")
+        return None
+
+
+def max_chars_for(max_input_tokens):
+    """
+    Number of characters to read so the text can fill max_input_tokens
+    """
+    return max_input_tokens * MAX_CHARS_PER_TOKEN
+
+
+def _trim_to_sentence(text):
+    """
+    Cut text after its last full sentence, or its last word if that would drop over half of it
+    """
+    end = 0
+    for match in SENTENCE_END.finditer(text):
+        end = match.start() + len(match.group().rstrip())
+    if end < len(text) // 2:
+        end = text.rfind(' ', len(text) // 2)
+    return text[:end] if end > 0 else text
+
+
+def _count(tokenizer, text):
+    if tokenizer is None:
+        return int(len(text) / FALLBACK_CHARS_PER_TOKEN) + 1
+    return len(tokenizer.encode(text).ids)
+
+
+def _prefix_within(tokenizer, text, budget):
+    """
+    Longest prefix of text that is at most budget tokens
+    """
+    if budget <= 0:
+        return ''
+    if tokenizer is None:
+        return text[:int(budget * FALLBACK_CHARS_PER_TOKEN)]
+
+    offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+    if len(offsets) <= budget:
+        return text
+    return text[:offsets[budget - 1][1]]
+
+
+def build_prompt(template, text, max_input_tokens):
+    """
+    Fill template's {text} field with as much of text as fits in max_input_tokens, as counted
+    by the endpoint tokenizer with special tokens. Text that does not fit is trimmed at a sentence
+    boundary. Returns a Prompt with the inputs, their token count and whether text was truncated.
+    """
+    tokenizer = get_tokenizer()
+    budget = max_input_tokens - _count(tokenizer, template.format(text=''))
+
+    body = _prefix_within(tokenizer, text, budget)
+    truncated = len(body) < len(text)
+    if truncated:
+        body = _trim_to_sentence(body)
+
+    inputs = template.format(text=body)
+    input_tokens = _count(tokenizer, inputs)
+    # Token merges across the template and text boundary can add a token, drop a word until it fits
+    while input_tokens > max_input_tokens and body:
+        body = body[:body.rfind(' ')] if ' ' in body else ''
+        truncated = True
+        inputs = template.format(text=body)
+        input_tokens = _count(tokenizer, inputs)
+
+    return Prompt(inputs, input_tokens, truncated)
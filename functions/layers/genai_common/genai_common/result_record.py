@@ -0,0 +1,47 @@
+import datetime
+import gzip
+import json
+import os
+
+RESULTS_BUCKET = os.environ.get('RESULTS_BUCKET', '')
+# Also write the extractive summary, title, abstract and authors as separate plain text objects
+WRITE_FIELD_OBJECTS = os.environ.get('WRITE_FIELD_OBJECTS', 'True').lower() == 'true'
+
+RECORD_VERSION = 1
+
+
+def build_record(uid, extractive_summary, title, abstract, authors, models, timings, **extra):
+    """
+    Consolidated result of one document. authors is the newline separated output of author extraction.
+    """
+    record = {
+        'record_version': RECORD_VERSION,
+        'uid': uid,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'extractive_summary': extractive_summary,
+        'title': title,
+        'abstract': abstract,
+        'authors': [name for name in authors.split("\n") if name],
+        'models': models,
+        'timings': timings
+    }
+    record.update(extra)
+    return record
+
+
+def write_record(s3, key, record, bucket=RESULTS_BUCKET):
+    """
+    Write record as gzip compressed JSON, under the same key as the per-field objects
+    """
+    s3.put_object(
+        Body=gzip.compress(json.dumps(record, ensure_ascii=False).encode('utf-8')),
+        Bucket=bucket,
+        Key=key,
+        ContentType='application/json',
+        ContentEncoding='gzip'
+    )
+
+
+def read_record(s3, key, bucket=RESULTS_BUCKET):
+    body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    return json.loads(gzip.decompress(body))
@@ -0,0 +1,91 @@
+import codecs
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STREAM_READ_BYTES = 1024 * 1024
+# A UTF-8 character takes at most 4 bytes
+MAX_BYTES_PER_CHAR = 4
+CONTENT_RANGE = re.compile(r'bytes \d+-\d+/(\d+|\*)')
+
+
+def _decoder():
+    return codecs.getincrementaldecoder('utf-8')(errors='ignore')
+
+
+def iter_decoded(body):
+    """
+    Incrementally decode a streaming S3 body without reading it whole
+    """
+    decoder = _decoder()
+    for chunk in body.iter_chunks(chunk_size=STREAM_READ_BYTES):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def _object_size(content_range):
+    match = CONTENT_RANGE.match(content_range or '')
+    if match and match.group(1) != '*':
+        return int(match.group(1))
+    return None
+
+
+def read_text_from_s3(s3, bucket, key, max_chars=None):
+    """
+    Read and decode an object, or only its first max_chars characters.
+
+    With max_chars, ranged GETs sized to the character budget are issued, so only the
+    needed bytes are transferred. Multi-byte characters split across ranges are carried
+    over by an incremental decoder, and a partial character at the end is dropped.
+    The result equals obj.decode('utf-8', errors='ignore')[:max_chars].
+    """
+    if max_chars is None:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        return obj['Body'].read().decode('utf-8', errors='ignore')
+
+    decoder = _decoder()
+    pieces = []
+    chars = 0
+    offset = 0
+    size = None
+    # ASCII text needs exactly max_chars bytes, so start there
+    range_bytes = max_chars
+
+    while chars < max_chars and (size is None or offset < size):
+        try:
+            obj = s3.get_object(
+                Bucket=bucket,
+                Key=key,
+                Range=f'bytes={offset}-{offset + range_bytes - 1}'
+            )
+        except s3.exceptions.ClientError as e:
+            # Raised for an empty object, whose first byte does not exist
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                break
+            raise
+
+        data = obj['Body'].read()
+        if not data:
+            break
+
+        if size is None:
+            size = _object_size(obj.get('ContentRange')) or obj.get('ContentLength')
+            # The server ignored the Range header and returned the whole object
+            if obj.get('ContentRange') is None:
+                size = len(data)
+
+        offset += len(data)
+        piece = decoder.decode(data)
+        pieces.append(piece)
+        chars += len(piece)
+
+        # Size the next range from the bytes per character observed so far
+        remaining = max_chars - chars
+        bytes_per_char = offset / chars if chars else MAX_BYTES_PER_CHAR
+        range_bytes = max(int(remaining * min(bytes_per_char, MAX_BYTES_PER_CHAR)) + MAX_BYTES_PER_CHAR, 1)
+
+    text = "".join(pieces)[:max_chars]
+    logger.info(f"Read {offset} bytes ({len(text)} characters) of s3://{bucket}/{key}")
+    return text
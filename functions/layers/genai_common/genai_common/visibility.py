@@ -0,0 +1,92 @@
+import functools
+import logging
+import os
+import threading
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Lease taken on the SQS message at every heartbeat, the queues' VisibilityTimeout is the same
+VISIBILITY_TIMEOUT_SECONDS = int(os.environ.get('VISIBILITY_TIMEOUT_SECONDS', 900))
+# SQS keeps a received message invisible for at most 12 hours
+MAX_VISIBILITY_TIMEOUT_SECONDS = 43_200
+
+_sqs = None
+
+
+def _client():
+    global _sqs
+    if _sqs is None:
+        _sqs = boto3.client('sqs')
+    return _sqs
+
+
+class VisibilityHeartbeat:
+    """
+    Keeps the SQS message of a document invisible while a stage works on it. The lease is
+    renewed when the stage starts, every third of the lease while it runs and when it ends,
+    which covers the wait before the next stage or retry. Once no stage renews it, the message
+    becomes visible again after one lease. Renewal errors are logged and end the heartbeat.
+
+        with VisibilityHeartbeat(event.get('MessageDetails')):
+            ...
+    """
+    def __init__(self, message_details, timeout=VISIBILITY_TIMEOUT_SECONDS):
+        message_details = message_details or {}
+        self.queue_url = message_details.get('QueueUrl')
+        self.receipt_handle = message_details.get('ReceiptHandle')
+        self.timeout = min(timeout, MAX_VISIBILITY_TIMEOUT_SECONDS)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lost = False
+
+    def extend(self):
+        try:
+            _client().change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=self.receipt_handle,
+                VisibilityTimeout=self.timeout
+            )
+        except ClientError as e:
+            # The message was deleted, redelivered under a new receipt handle or held for 12 hours
+            logger.warning(f"Visibility of the message not extended: {e}")
+            self.lost = True
+            self.stopped.set()
+            return False
+        return True
+
+    def _run(self):
+        while not self.stopped.wait(self.timeout / 3):
+            self.extend()
+
+    def __enter__(self):
+        # Started on its own, without a message to keep
+        if not self.queue_url or not self.receipt_handle:
+            return self
+        if self.extend():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.thread is None:
+            return False
+        self.stopped.set()
+        self.thread.join()
+        if not self.lost:
+            self.extend()
+        return False
+
+
+def keep_message_invisible(handler):
+    """
+    Lambda handler decorator that holds a VisibilityHeartbeat on the message in event['MessageDetails']
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        with VisibilityHeartbeat(event.get('MessageDetails')):
+            return handler(event, context)
+    return wrapper
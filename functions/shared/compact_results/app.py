@@ -0,0 +1,258 @@
+import boto3
+import datetime
+import gzip
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
+
+logger = Logger()
+
+RESULTS_BUCKET = os.environ['RESULTS_BUCKET']
+DOC_DDB_STATE_TABLE = os.environ['DOC_DDB_STATE_TABLE']
+# Documents are found through the days they were completed on, state items expire after DOC_STATE_TTL_DAYS
+COMPLETED_INDEX = os.environ.get('COMPLETED_INDEX', 'CompletedDocumentsIndex')
+TIME_TO_LIVE_DAYS = int(os.environ.get('DOC_STATE_TTL_DAYS', 30))
+EXPORT_BUCKET = os.environ.get('EXPORT_BUCKET') or RESULTS_BUCKET
+# Kept apart from the result records
+EXPORT_PREFIX = os.environ.get('EXPORT_PREFIX', 'exports/')
+# parquet, or jsonl for gzip compressed JSON lines. Parquet falls back to jsonl when pyarrow is not available.
+EXPORT_FORMAT = os.environ.get('EXPORT_FORMAT', 'parquet').lower()
+# Uncompressed size of the records in one part file
+MAX_PART_BYTES = int(os.environ.get('MAX_PART_BYTES', 128 * 1024 * 1024))
+READ_MAX_WORKERS = int(os.environ.get('READ_MAX_WORKERS', 32))
+# Time kept back at the end of an invocation to flush the open parts and write the manifest
+FLUSH_MARGIN_MILLIS = int(os.environ.get('FLUSH_MARGIN_MILLIS', 120_000))
+
+MANIFEST_KEY = f"{EXPORT_PREFIX}manifest.json"
+MANIFEST_VERSION = 1
+
+COLUMNS = [
+    'uid', 'created_at', 'title', 'abstract', 'extractive_summary', 'authors',
+    'duplicate_of', 'models', 'timings', 'record_version'
+]
+
+s3 = boto3.client('s3')
+ddb = boto3.client('dynamodb')
+executor = ThreadPoolExecutor(max_workers=READ_MAX_WORKERS)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_SCHEMA = pa.schema([
+        ('uid', pa.string()),
+        ('created_at', pa.string()),
+        ('title', pa.string()),
+        ('abstract', pa.string()),
+        ('extractive_summary', pa.string()),
+        ('authors', pa.list_(pa.string())),
+        ('duplicate_of', pa.string()),
+        ('models', pa.string()),
+        ('timings', pa.string()),
+        ('record_version', pa.int32())
+    ])
+except ImportError:
+    pa = None
+
+if EXPORT_FORMAT == 'parquet' and pa is None:
+    logger.warning("pyarrow is not available, exporting gzip JSON lines")
+    EXPORT_FORMAT = 'jsonl'
+
+
+def read_manifest():
+    try:
+        body = s3.get_object(Bucket=EXPORT_BUCKET, Key=MANIFEST_KEY)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {'manifest_version': MANIFEST_VERSION, 'watermark': None, 'in_progress': None, 'runs': []}
+        raise
+    return json.loads(body)
+
+
+def write_manifest(manifest):
+    s3.put_object(
+        Body=json.dumps(manifest, indent=1).encode('utf-8'),
+        Bucket=EXPORT_BUCKET,
+        Key=MANIFEST_KEY,
+        ContentType='application/json'
+    )
+
+
+def window_days(window_start, window_end):
+    """
+    Days of the window, the first export covers the documents still in the state table
+    """
+    end = datetime.date.fromisoformat(window_end[:10])
+    if window_start:
+        start = datetime.date.fromisoformat(window_start[:10])
+    else:
+        start = end - datetime.timedelta(days=TIME_TO_LIVE_DAYS)
+    return [(start + datetime.timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+
+
+def iter_new_keys(window_start, window_end, cursor):
+    """
+    Pages of the result record keys of the documents completed in (window_start, window_end], day by
+    day from the completed documents index, with the cursor after each page. cursor is where a
+    previous invocation stopped, None to start from the first day.
+    """
+    for day in window_days(window_start, window_end):
+        if cursor and day < cursor['day']:
+            continue
+        kwargs = {
+            'TableName': DOC_DDB_STATE_TABLE,
+            'IndexName': COMPLETED_INDEX,
+            'KeyConditionExpression': 'completed_day = :day AND updated_at BETWEEN :start AND :end',
+            'ExpressionAttributeValues': {
+                ':day': {'S': day},
+                ':start': {'S': window_start or day},
+                ':end': {'S': window_end}
+            }
+        }
+        if cursor and day == cursor['day']:
+            if cursor['start_key'] is None:
+                continue
+            kwargs['ExclusiveStartKey'] = cursor['start_key']
+
+        while True:
+            page = ddb.query(**kwargs)
+            keys = [
+                item['result_key']['S'] if 'result_key' in item
+                else item['s3_path']['S'].replace("_extracted_text.txt", ".txt")
+                for item in page['Items']
+                # The window start is exclusive, its documents went to the previous run
+                if item['updated_at']['S'] != window_start
+            ]
+            start_key = page.get('LastEvaluatedKey')
+            yield keys, {'day': day, 'start_key': start_key}
+            if start_key is None:
+                break
+            kwargs['ExclusiveStartKey'] = start_key
+
+
+def read_row(key):
+    try:
+        body = s3.get_object(Bucket=RESULTS_BUCKET, Key=key)['Body'].read()
+    except ClientError as e:
+        # Records of completed documents can be overwritten by a re-run, or removed
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        logger.warning(f"Skipping {key}, no result record")
+        return None
+    try:
+        record = json.loads(gzip.decompress(body))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Skipping {key}, not a result record: {e}")
+        return None
+    row = {column: record.get(column) for column in COLUMNS}
+    row['uid'] = row['uid'] or key
+    row['models'] = json.dumps(row['models'])
+    row['timings'] = json.dumps(row['timings'])
+    return row
+
+
+def encode_part(rows):
+    if EXPORT_FORMAT == 'parquet':
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(rows, schema=PARQUET_SCHEMA), buffer, compression='zstd')
+        return buffer.getvalue(), 'parquet'
+    lines = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    return gzip.compress(lines.encode('utf-8')), 'jsonl.gz'
+
+
+class PartWriter:
+    """
+    Buffers rows per dt partition and writes a part file whenever a partition reaches MAX_PART_BYTES
+    """
+    def __init__(self, run):
+        self.run = run
+        self.buffers = {}
+
+    def add(self, row):
+        partition = (row['created_at'] or '')[:10] or 'unknown'
+        buffer = self.buffers.setdefault(partition, {'rows': [], 'bytes': 0})
+        buffer['rows'].append(row)
+        buffer['bytes'] += sum(len(value) for value in row.values() if isinstance(value, str))
+        if buffer['bytes'] >= MAX_PART_BYTES:
+            self.flush(partition)
+
+    def flush(self, partition):
+        rows = self.buffers.pop(partition)['rows']
+        body, extension = encode_part(rows)
+        # Part numbers continue from the checkpoint, so a retried invocation overwrites its own unlisted parts
+        key = f"{EXPORT_PREFIX}dt={partition}/run={self.run['run_id']}/part-{len(self.run['parts']):05d}.{extension}"
+        s3.put_object(Body=body, Bucket=EXPORT_BUCKET, Key=key)
+        self.run['parts'].append({'key': key, 'records': len(rows), 'bytes': len(body), 'partition': partition})
+        logger.info(f"Wrote {key} with {len(rows)} records")
+
+    def flush_all(self):
+        for partition in list(self.buffers):
+            self.flush(partition)
+
+
+def compact(run, context):
+    """
+    Export the records of run's window, returns True when the window is done and False when the
+    invocation ran out of time. The run is checkpointed after the last index page of its written parts.
+    """
+    writer = PartWriter(run)
+    for keys, cursor in iter_new_keys(run['window_start'], run['window_end'], run.get('cursor')):
+        # Bounded by READ_MAX_WORKERS concurrent reads, rows come back in index order
+        for row in executor.map(read_row, keys):
+            if row is not None:
+                writer.add(row)
+        run['cursor'] = cursor
+
+        if context.get_remaining_time_in_millis() < FLUSH_MARGIN_MILLIS:
+            writer.flush_all()
+            return False
+
+    writer.flush_all()
+    return True
+
+
+def lambda_handler(event, context):
+    """
+    Append the result records written since the last export to the export dataset. Every run adds
+    new part files under dt=<date>/run=<run id>/ and never rewrites earlier ones, the manifest lists
+    the parts of every completed run. Returns done False when the state machine should invoke again.
+    """
+    manifest = read_manifest()
+    run = manifest['in_progress']
+    resumed = run is not None
+    if not resumed:
+        run = {
+            'run_id': event.get('run_id') or datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S'),
+            'window_start': manifest['watermark'],
+            'window_end': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'cursor': None,
+            'format': EXPORT_FORMAT,
+            'parts': []
+        }
+    else:
+        logger.info(f"Resuming unfinished export run {run['run_id']}")
+
+    done = compact(run, context)
+    if done:
+        run.pop('cursor', None)
+        run['records'] = sum(part['records'] for part in run['parts'])
+        if run['parts']:
+            manifest['runs'].append(run)
+        manifest['watermark'] = run['window_end']
+        manifest['in_progress'] = None
+    else:
+        manifest['in_progress'] = run
+    write_manifest(manifest)
+
+    records = sum(part['records'] for part in run['parts'])
+    logger.info(f"Export run {run['run_id']}: {records} records in {len(run['parts'])} parts, done: {done}")
+
+    return {
+        'statusCode': 200,
+        'run_id': run['run_id'],
+        # A run left unfinished by an earlier execution ends at its own window end, so a new run follows it
+        'done': done and not (resumed and run['run_id'] != event.get('run_id')),
+        'records': records
+    }
@@ -21,6 +21,7 @@ DLC_ACCOUNTS_BY_REGION = os.environ['DLC_ACCOUNTS_BY_REGION']
 MODEL_IMAGES = os.environ['MODEL_IMAGES']
 MODEL_TYPE = os.environ['MODEL_TYPE']
 MODEL_INSTANCE_TYPES = os.environ['MODEL_INSTANCE_TYPES']
+ENDPOINT_INSTANCE_COUNTS = os.environ['ENDPOINT_INSTANCE_COUNTS']
 
 MODEL_IMAGES = ast.literal_eval(MODEL_IMAGES)
 MODEL_IMAGE = MODEL_IMAGES[MODEL_TYPE]
@@ -30,6 +31,8 @@ DLC_AWS_ACCOUNT_ID = DLC_ACCOUNTS_BY_REGION[AWS_REGION_NAME]
 
 MODEL_PATHS = ast.literal_eval(MODEL_PATHS)
 MODEL_INSTANCE_TYPES = ast.literal_eval(MODEL_INSTANCE_TYPES)
+# Endpoints start at their minimum instance count, the scaling controller adds instances for the backlog
+INITIAL_INSTANCE_COUNT = ast.literal_eval(ENDPOINT_INSTANCE_COUNTS)[MODEL_TYPE]['min']
 
 if MODEL_TYPE == "llm":
     ENVIRONMENT = {
@@ -61,6 +64,7 @@ logger.info(f"MODEL_DATA_URL: {MODEL_DATA_URL}")
 logger.info(f"ENVIRONMENT: {ENVIRONMENT}")
 logger.info(f"ENDPOINT_CONFIG_NAME: {ENDPOINT_CONFIG_NAME}")
 logger.info(f"ENDPOINT_NAME: {ENDPOINT_NAME}")
+logger.info(f"INITIAL_INSTANCE_COUNT: {INITIAL_INSTANCE_COUNT}")
 
 
 def lambda_handler(event, context):
@@ -87,7 +91,7 @@ def lambda_handler(event, context):
             {
                 'VariantName': f'{MODEL_NAME}-Variant',
                 'ModelName': MODEL_NAME,
-                'InitialInstanceCount': 1,
+                'InitialInstanceCount': INITIAL_INSTANCE_COUNT,
                 'InstanceType': MODEL_INSTANCE_TYPE,
                 'ModelDataDownloadTimeoutInSeconds': 3600,
                 # 'ContainerStartupHealthCheckTimeoutInSeconds': 3600
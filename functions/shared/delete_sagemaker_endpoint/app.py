@@ -1,6 +1,8 @@
 import boto3
 import json
 import os
+import time
+from botocore.exceptions import ClientError
 
 from aws_lambda_powertools import Logger
 logger = Logger()
@@ -11,44 +13,86 @@ ENV = os.environ['ENV']
 MODEL_NAME = os.environ['MODEL_NAME']
 ENDPOINT_CONFIG_NAME = os.environ['ENDPOINT_CONFIG_NAME']
 ENDPOINT_NAME = os.environ['ENDPOINT_NAME']
+POLL_SECONDS = int(os.environ.get('POLL_SECONDS', 15))
+# Time kept back at the end of an invocation to delete the endpoint config and model
+RESERVED_SECONDS = int(os.environ.get('RESERVED_SECONDS', 30))
 
 MODEL_NAME = f"{ENV}-{MODEL_NAME}"
 ENDPOINT_CONFIG_NAME = f"{ENV}-{ENDPOINT_CONFIG_NAME}"
 ENDPOINT_NAME = f"{ENV}-{ENDPOINT_NAME}"
 
+# An endpoint cannot be deleted while it is in one of these, a capacity update of the scaling controller leaves it Updating
+TRANSITIONAL_STATUSES = {'Creating', 'Updating', 'SystemUpdating', 'RollingBack'}
 
-def lambda_handler(event, context):
+
+def _not_found(e):
+    return e.response['Error']['Code'] == 'ValidationException' and 'Could not find' in e.response['Error']['Message']
+
+
+def wait_deletable(context):
+    """
+    Wait until the endpoint has left the transitional statuses. Returns False when there is no
+    endpoint to delete, raises TimeoutError when it is still in transition at the end of the invocation.
+    """
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - RESERVED_SECONDS
+    while True:
+        try:
+            status = client.describe_endpoint(EndpointName=ENDPOINT_NAME)['EndpointStatus']
+        except ClientError as e:
+            if _not_found(e):
+                return False
+            raise
+
+        if status == 'Deleting':
+            return False
+        if status not in TRANSITIONAL_STATUSES:
+            return True
+        if time.monotonic() + POLL_SECONDS > deadline:
+            raise TimeoutError(f"{ENDPOINT_NAME} is still {status}, the state machine retries the deletion")
+
+        logger.info(f"{ENDPOINT_NAME} is {status}, waiting before deleting it")
+        time.sleep(POLL_SECONDS)
+
+
+def _delete_if_exists(delete, **kwargs):
     try:
+        response = delete(**kwargs)
+    except ClientError as e:
+        if not _not_found(e):
+            raise
+        logger.info(f"{kwargs} does not exist")
+        return
+    logger.info(f"{delete.__name__} API response: {response}")
+
+
+def lambda_handler(event, context):
+    """
+    Delete the endpoint, its config and its model. Errors are raised, so the state machine retries
+    the deletion and reports an endpoint that is still running.
+    """
+    if wait_deletable(context):
         logger.info(f"Deleting {ENDPOINT_NAME} endpoint")
-        response = client.delete_endpoint(EndpointName=ENDPOINT_NAME)
-        logger.info(f"delete_endpoint API response: {response}")
+        _delete_if_exists(client.delete_endpoint, EndpointName=ENDPOINT_NAME)
 
         # SNS message
         sns_message = f"SageMaker endpoint '{ENDPOINT_NAME}' is being deleted."
+        try:
+            sns_response = sns_client.publish(
+                TopicArn=os.environ['SNS_TOPIC_ARN'],
+                Message=sns_message,
+                Subject=f'SageMaker Endpoint Deletion Notification: {ENDPOINT_NAME}',
+            )
+            logger.info(f"sns publish response: {sns_response}")
+        except ClientError as e:
+            logger.error(f"Deletion notification of {ENDPOINT_NAME} not published: {e}")
+    else:
+        logger.info(f"{ENDPOINT_NAME} does not exist or is already being deleted")
 
-        sns_response = sns_client.publish(
-            TopicArn=os.environ['SNS_TOPIC_ARN'],
-            Message=sns_message,
-            Subject=f'SageMaker Endpoint Deletion Notification: {ENDPOINT_NAME}',
-        )
-        logger.info(f"sns publish response: {sns_response}")
-        print('SNS message published')
-    except Exception as e:
-        logger.error(f"Error in deleting {ENDPOINT_NAME} endpoint: {e}")
+    logger.info(f"Deleting {ENDPOINT_CONFIG_NAME} endpoint config")
+    _delete_if_exists(client.delete_endpoint_config, EndpointConfigName=ENDPOINT_CONFIG_NAME)
 
-    try:
-        logger.info(f"Deleting {ENDPOINT_CONFIG_NAME} endpoint config")
-        response = client.delete_endpoint_config(EndpointConfigName=ENDPOINT_CONFIG_NAME)
-        logger.info(f"delete_endpoint_config API response: {response}")
-    except Exception as e:
-        logger.error(f"Error in deleting {ENDPOINT_NAME} endpoint: {e}")
-
-    try:
-        logger.info(f"Deleting {MODEL_NAME} model")
-        response = client.delete_model(ModelName=MODEL_NAME)
-        logger.info(f"delete_model API response: {response}")
-    except Exception as e:
-        logger.error(f"Error in deleting {MODEL_NAME} endpoint: {e}")
+    logger.info(f"Deleting {MODEL_NAME} model")
+    _delete_if_exists(client.delete_model, ModelName=MODEL_NAME)
 
     return {
         'statusCode': 200,
@@ -1,5 +1,7 @@
 import ast
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import os
@@ -15,8 +17,28 @@ CHECK_LLM_UP = ast.literal_eval(os.environ['CHECK_LLM_UP'])
 PUSH_TO_QUEUE_LAMBDA = os.environ['PUSH_TO_QUEUE_LAMBDA']
 BATCH_SIZE = int(os.environ['BATCH_SIZE'])
 
+# Listing is split into shards that are listed concurrently. Shards are either
+# key ranges split at LIST_SHARD_BOUNDARIES or the prefixes discovered with LIST_DELIMITER.
+LIST_DELIMITER = os.environ.get('LIST_DELIMITER', '/')
+LIST_SHARD_BOUNDARIES = [x for x in os.environ.get('LIST_SHARD_BOUNDARIES', '').split(',') if x]
+LISTING_MAX_WORKERS = int(os.environ.get('LISTING_MAX_WORKERS', 16))
+INVOKE_MAX_WORKERS = int(os.environ.get('INVOKE_MAX_WORKERS', 16))
+# Async (Event) invocations accept payloads up to 256 KB
+MAX_PAYLOAD_BYTES = int(os.environ.get('MAX_PAYLOAD_BYTES', 240_000))
+# Documents of at least this size go to the large document lane, largest first. 0 puts every document in one lane.
+LARGE_DOCUMENT_BYTES = int(os.environ.get('LARGE_DOCUMENT_BYTES', 2_000_000))
+
+LAMBDA_DYNAMODB_RESOURCE = {
+    "resource": boto3.resource('dynamodb'),
+    "table_name": os.environ.get("DOC_DDB_STATE_TABLE", "NONE")
+}
+
 STATE_MACHINE_ARN = os.environ.get("GEN_AI_STATE_MACHINE_ARN", "NONE")
 TIME_TO_LIVE_DAYS = int(os.environ.get("DOC_STATE_TTL_DAYS", 30))
+# Upper bound on the wait for every push_to_queue batch to land before the state machine starts
+READINESS_TIMEOUT_SECONDS = int(os.environ.get("READINESS_TIMEOUT_SECONDS", 600))
+# Prefix of the per-run counter items kept in the state table, see push_to_queue
+RUN_KEY_PREFIX = "run#"
 
 NER_ENDPOINT_NAME = f"{ENV}-{NER_ENDPOINT_NAME}"
 LLM_ENDPOINT_NAME = f"{ENV}-{LLM_ENDPOINT_NAME}"
@@ -56,26 +78,202 @@ sfn_client = boto3.client('stepfunctions')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+ddb_state_resource = LambdaDynamoDBClass(LAMBDA_DYNAMODB_RESOURCE)
+
 
-def _get_all_files_from_bucket(bucket):
+def _iter_objects_in_bucket(bucket, prefix='', start_after='', end_at=None, delimiter=None):
+    """
+    Lazily yield the (key, size) pairs of a bucket shard. list_objects_v2 returns keys in
+    lexicographic (UTF-8 binary) order, which the merge below relies on.
+    """
     paginator = s3.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=bucket)
-    all_files = []
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    pages = paginator.paginate(**kwargs)
 
     for page in pages:
         for obj in page.get('Contents', []):
-            all_files.append(obj['Key'])
+            if obj['Key'] is None:
+                continue
+            if end_at is not None and obj['Key'] > end_at:
+                return
+            yield obj['Key'], obj['Size']
+
+
+def _discover_shards(bucket):
+    """
+    Split the key space of a bucket into shards that can be listed independently.
+    Each shard is a dict of _iter_objects_in_bucket keyword arguments.
+    """
+    if LIST_SHARD_BOUNDARIES:
+        boundaries = sorted(LIST_SHARD_BOUNDARIES)
+        lower_bounds = [''] + boundaries
+        upper_bounds = boundaries + [None]
+        return [
+            {'start_after': lower, 'end_at': upper}
+            for lower, upper in zip(lower_bounds, upper_bounds)
+        ]
+
+    if not LIST_DELIMITER:
+        return [{}]
+
+    # Keys at the root level form one shard, every common prefix forms another one
+    shards = [{'delimiter': LIST_DELIMITER}]
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Delimiter=LIST_DELIMITER):
+        for common_prefix in page.get('CommonPrefixes', []):
+            shards.append({'prefix': common_prefix['Prefix']})
+
+    return shards
+
+
+def _files_to_process(shard):
+    return _sorted_difference(
+        sorted_files=_iter_objects_in_bucket(CONTAINS_BUCKET, **shard),
+        sorted_keys=(key for key, _ in _iter_objects_in_bucket(DOES_NOT_CONTAIN_BUCKET, **shard))
+    )
+
+
+def _sorted_difference(sorted_files, sorted_keys):
+    """
+    Yield (key, size) pairs of sorted_files whose key is not in sorted_keys with a
+    sort-merge over both streams, holding one key of each in memory.
+    """
+    keys_2 = iter(sorted_keys)
+    key_2 = next(keys_2, None)
+
+    for file in sorted_files:
+        key_1 = file[0]
+        while key_2 is not None and key_2 < key_1:
+            key_2 = next(keys_2, None)
+
+        if key_2 is None or key_2 != key_1:
+            yield file
+
+
+def _batched(iterable, batch_size, max_payload_bytes=MAX_PAYLOAD_BYTES):
+    """
+    Group items into lists of at most batch_size items whose JSON encoding
+    stays under max_payload_bytes.
+    """
+    batch = []
+    payload_bytes = 2
+    for item in iterable:
+        item_bytes = len(json.dumps(item).encode('utf-8')) + 2
+        if batch and payload_bytes + item_bytes > max_payload_bytes:
+            yield batch
+            batch = []
+            payload_bytes = 2
+
+        batch.append(item)
+        payload_bytes += item_bytes
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+            payload_bytes = 2
+
+    if batch:
+        yield batch
+
+
+def _fan_out(shards, run_id):
+    """
+    List every shard concurrently and invoke PUSH_TO_QUEUE_LAMBDA for each batch as soon
+    as it fills up, tagged with run_id. In-flight invocations are bounded so memory stays constant.
+    Documents of LARGE_DOCUMENT_BYTES or more are held back and pushed to the large lane once
+    listing is done, largest first, so the longest jobs start in the first waves of the run.
+    Returns (number_of_files, number_of_batches, failed_batches).
+    """
+    in_flight = threading.BoundedSemaphore(INVOKE_MAX_WORKERS * 2)
+    lock = threading.Lock()
+    stats = {'files': 0, 'batches': 0}
+    failed_batches = []
+    large_files = []
+
+    def push(batch, lane):
+        list_of_files = [key for key, _ in batch]
+        try:
+            lambda_client.invoke(
+                FunctionName=PUSH_TO_QUEUE_LAMBDA,
+                Payload=json.dumps({
+                    'run_id': run_id,
+                    'lane': lane,
+                    'files': list_of_files,
+                    'sizes': [size for _, size in batch]
+                }),
+                InvocationType='Event'
+            )
+            with lock:
+                stats['files'] += len(list_of_files)
+                stats['batches'] += 1
+                logger.info(f"files pushing to queue via push_to_queue lambda: {stats['files']}")
+        except Exception as e:
+            logger.error(f"Error invoking {PUSH_TO_QUEUE_LAMBDA}: {e}")
+            with lock:
+                failed_batches.append(list_of_files)
+        finally:
+            in_flight.release()
+
+    def small_files(files):
+        for key, size in files:
+            if LARGE_DOCUMENT_BYTES and size >= LARGE_DOCUMENT_BYTES:
+                with lock:
+                    large_files.append((key, size))
+            else:
+                yield key, size
+
+    with ThreadPoolExecutor(max_workers=INVOKE_MAX_WORKERS) as invoke_executor:
+        def list_shard(shard):
+            for batch in _batched(small_files(_files_to_process(shard)), BATCH_SIZE):
+                in_flight.acquire()
+                invoke_executor.submit(push, batch, 'default')
+
+        with ThreadPoolExecutor(max_workers=LISTING_MAX_WORKERS) as listing_executor:
+            # list() re-raises listing errors
+            list(listing_executor.map(list_shard, shards))
+
+        # Longest processing time first
+        large_files.sort(key=lambda file: file[1], reverse=True)
+        logger.info(f"Number of large documents: {len(large_files)}")
+        for batch in _batched(large_files, BATCH_SIZE):
+            in_flight.acquire()
+            invoke_executor.submit(push, batch, 'large')
+
+    return stats['files'], stats['batches'], failed_batches
+
+
+def _wait_for_batches_to_land(run_id, expected_batches, timeout):
+    """
+    Poll the run's counter item until every pushed batch has been recorded by
+    push_to_queue, or until timeout seconds have passed. Returns the number of batches landed.
+    """
+    run_key = f"{RUN_KEY_PREFIX}{run_id}"
+    deadline = time.monotonic() + timeout
+    delay = 0.5
 
-    all_files = [x for x in all_files if x is not None]
+    while True:
+        item = ddb_state_resource.table.get_item(
+            Key={'s3_path': run_key},
+            ConsistentRead=True
+        ).get('Item', {})
+        batches_landed = int(item.get('batches_landed', 0))
 
-    logger.info(f'Number of files in {bucket}: {len(all_files)}')
-    return all_files
+        if batches_landed >= expected_batches:
+            logger.info(f"All {expected_batches} batches landed, "
+                        f"files enqueued: {int(item.get('files_enqueued', 0))}, "
+                        f"files failed: {int(item.get('files_failed', 0))}")
+            return batches_landed
 
+        if time.monotonic() + delay > deadline:
+            logger.warning(f"Timed out after {timeout}s waiting for batches to land: "
+                           f"{batches_landed}/{expected_batches}")
+            return batches_landed
 
-def _list_set_difference(list_1, list_2):
-    set_1 = set(list_1)
-    set_2 = set(list_2)
-    return list(set_1 - set_2)
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
 
 
 def _check_llm_up(endpoint_name):
@@ -98,44 +296,61 @@ def _check_llm_up(endpoint_name):
     return llm_up
 
 
-def single_list_to_list_of_lists(single_list, inner_list_size=10):
-    return [single_list[i:i + inner_list_size] for i in range(0, len(single_list), inner_list_size)]
+def _execution_running():
+    """
+    Endpoints also return to InService after capacity updates of the scaling controller,
+    those must not start a second run while one is in progress
+    """
+    executions = sfn_client.list_executions(
+        stateMachineArn=STATE_MACHINE_ARN,
+        statusFilter='RUNNING',
+        maxResults=1
+    )['executions']
+    return bool(executions)
 
 
 def lambda_handler(event, context):
     logger.info(f'CHECK_LLM_UP: {CHECK_LLM_UP}')
-    contains_bucket_files = _get_all_files_from_bucket(CONTAINS_BUCKET)
-    does_not_contains_bucket_files = _get_all_files_from_bucket(DOES_NOT_CONTAIN_BUCKET)
-
-    files_to_process = _list_set_difference(
-        list_1=contains_bucket_files,
-        list_2=does_not_contains_bucket_files
-    )
-    logger.info(f'Number of files to process: {len(files_to_process)}')
     logger.info(f'BATCH_SIZE: {BATCH_SIZE}')
 
+    if _execution_running():
+        logger.info("State machine is already running, not starting another run")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'responses': []
+            }),
+        }
+
     if not CHECK_LLM_UP or (_check_llm_up(LLM_ENDPOINT_NAME) and _check_llm_up(NER_ENDPOINT_NAME)):
         responses = []
-        files_to_process = single_list_to_list_of_lists(
-            single_list=files_to_process,
-            inner_list_size=BATCH_SIZE
-        )
-        logger.info(f'Number of batches: {len(files_to_process)}')
-
-        for index, list_of_files in enumerate(files_to_process):
-            lambda_client.invoke(
-                FunctionName=PUSH_TO_QUEUE_LAMBDA,
-                Payload=json.dumps(list_of_files),
-                InvocationType='Event'
-            )
-            logger.info(f"files pushing to queue via push_to_queue lambda: {(index + 1) * len(list_of_files)}")
+        shards = _discover_shards(CONTAINS_BUCKET)
+        logger.info(f'Number of listing shards: {len(shards)}')
+
+        run_id = context.aws_request_id
+        number_of_files, number_of_batches, failed_batches = _fan_out(shards, run_id)
+
+        logger.info(f'Number of files to process: {number_of_files}')
+        logger.info(f'Number of batches: {number_of_batches}')
+        if failed_batches:
+            logger.error(f'Number of batches not pushed to queue: {len(failed_batches)}')
+
+        # Leave enough time to start the execution before the function times out
+        timeout = min(READINESS_TIMEOUT_SECONDS, context.get_remaining_time_in_millis() / 1000 - 30)
+        batches_landed = 0
+        if number_of_batches:
+            batches_landed = _wait_for_batches_to_land(run_id, number_of_batches, max(timeout, 0))
+        batches_missing = number_of_batches - batches_landed
+        if batches_missing:
+            # Their messages are still enqueued, the run receives the ones that arrive before the queue drains
+            logger.warning(f"Starting the step function with {batches_missing} of {number_of_batches} batches "
+                           f"not landed in the queue")
 
-        time.sleep(30)  # adjust as needed
         logger.info(f"Triggering step function...")
         response = sfn_client.start_execution(
             stateMachineArn=STATE_MACHINE_ARN,
             input=json.dumps({})
-        )  
+        )
 
         return {
             'statusCode': 200,
@@ -145,7 +360,12 @@ def lambda_handler(event, context):
                     "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
             },
             'body': json.dumps({
-                'responses': responses           
+                'responses': responses,
+                'batches': {
+                    'pushed': number_of_batches,
+                    'landed': batches_landed,
+                    'missing': batches_missing
+                }
             }),
         }
 
@@ -156,6 +376,3 @@ def lambda_handler(event, context):
               "error": "LLMs not up"
             }),
         }
-
-    
-
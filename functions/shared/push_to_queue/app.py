@@ -3,6 +3,10 @@ import os
 import logging
 import json
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 LAMBDA_DYNAMODB_RESOURCE = {
     "resource": boto3.resource('dynamodb'),
@@ -14,8 +18,26 @@ LAMBDA_SQS_RESOURCE = {
     "queue_name": os.environ.get("FILE_SQS_QUEUE_NAME", "NONE")
 }
 
+# Queue of the large document lane, received before the file processing queue
+LAMBDA_LARGE_SQS_RESOURCE = {
+    "resource": boto3.resource('sqs'),
+    "queue_name": os.environ.get("LARGE_FILE_SQS_QUEUE_NAME", "")
+}
+
 STATE_MACHINE_ARN = os.environ.get("GEN_AI_STATE_MACHINE_ARN", "NONE")
 TIME_TO_LIVE_DAYS = int(os.environ.get("DOC_STATE_TTL_DAYS", 30))
+MAX_WORKERS = int(os.environ.get("PUSH_TO_QUEUE_MAX_WORKERS", 8))
+MAX_ATTEMPTS = int(os.environ.get("PUSH_TO_QUEUE_MAX_ATTEMPTS", 5))
+# Conditional state writes in flight per batch. They cannot be batched, BatchWriteItem has no conditions
+STATE_WRITE_WORKERS = int(os.environ.get("PUSH_TO_QUEUE_STATE_WRITE_WORKERS", 8))
+
+# Prefix of the per-run counter items kept in the state table
+RUN_KEY_PREFIX = "run#"
+
+# Files whose state is written and then enqueued by one worker
+INGEST_BATCH_SIZE = 25
+# Service limit for a single batch request
+SQS_BATCH_SIZE = 10
 
 
 class LambdaDynamoDBClass:
@@ -29,6 +51,10 @@ class LambdaDynamoDBClass:
         self.resource = lambda_dynamodb_resource["resource"]
         self.table_name = lambda_dynamodb_resource["table_name"]
         self.table = self.resource.Table(self.table_name)
+        # Low-level clients are thread safe, resources are not. The resource's own client
+        # serializes Python values, items here are already written in DynamoDB JSON. One connection
+        # per concurrent state write
+        self.client = boto3.client('dynamodb', config=Config(max_pool_connections=MAX_WORKERS * STATE_WRITE_WORKERS))
 
 
 class LambdaSQSClass:
@@ -42,6 +68,7 @@ class LambdaSQSClass:
         self.resource = lambda_sqs_resource["resource"]
         self.queue_name = lambda_sqs_resource["queue_name"]
         self.queue = self.resource.Queue(self.queue_name)
+        self.client = self.resource.meta.client
 
 
 s3 = boto3.client('s3')
@@ -50,56 +77,243 @@ sagemaker = boto3.client('sagemaker')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Created once per container and reused across warm invocations
+ddb_state_resource = LambdaDynamoDBClass(LAMBDA_DYNAMODB_RESOURCE)
+sqs = LambdaSQSClass(LAMBDA_SQS_RESOURCE)
+large_sqs = LambdaSQSClass(LAMBDA_LARGE_SQS_RESOURCE) if LAMBDA_LARGE_SQS_RESOURCE["queue_name"] else sqs
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _backoff(attempt):
+    time.sleep(min(0.05 * (2 ** attempt), 2))
+
+
+def _write_state(file, expiry, updated_at):
+    """
+    Write the INGESTED state row of file unless the document already has one, so ingesting
+    it again does not move an in-flight or DONE document back. Throttled writes and connection
+    errors are retried, the write is conditional so a retry cannot overwrite a newer state.
+    Returns the failure entry of the file, None once its row exists.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            ddb_state_resource.client.put_item(
+                TableName=ddb_state_resource.table_name,
+                Item={
+                    's3_path': {'S': file},
+                    'status': {'S': "INGESTED"},
+                    # Stages only move the status forward, see genai_common.document_state
+                    'status_rank': {'N': '0'},
+                    # Key of the incomplete documents index, removed once the document is DONE
+                    'pending_key': {'S': f"INGESTED#{updated_at[:10]}"},
+                    'updated_at': {'S': updated_at},
+                    'ttl': {'N': str(expiry)}
+                },
+                ConditionExpression='attribute_not_exists(s3_path)'
+            )
+            return None
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code == 'ConditionalCheckFailedException':
+                logger.info(f"{file} is already ingested, its state is kept")
+                return None
+            if code not in ('ProvisionedThroughputExceededException', 'ThrottlingException'):
+                return _error_failures([file], 'dynamodb', e)[0]
+            logger.warning(f"DynamoDB throttled the state write of {file} (attempt {attempt + 1})")
+        except BotoCoreError as e:
+            logger.warning(f"State write of {file} failed: {e} (attempt {attempt + 1})")
+        _backoff(attempt)
+
+    return {
+        'uid': file,
+        'stage': 'dynamodb',
+        'code': 'MaxAttemptsExceeded',
+        'message': f'State not written after {MAX_ATTEMPTS} attempts'
+    }
+
+
+def _write_state_batch(files, expiry):
+    """
+    Write the INGESTED state rows of files concurrently, returns the failure entries of the files
+    whose row was not written
+    """
+    updated_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    with ThreadPoolExecutor(max_workers=STATE_WRITE_WORKERS) as executor:
+        failures = list(executor.map(lambda file: _write_state(file, expiry, updated_at), files))
+    return [failure for failure in failures if failure is not None]
+
+
+def _error_failures(files, stage, error):
+    """
+    Failure entries for files whose batch request raised error, a ClientError or a BotoCoreError
+    such as a connection or read timeout
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        message = error.response.get('Error', {}).get('Message')
+    else:
+        code = type(error).__name__
+        message = str(error)
+    return [{'uid': file, 'stage': stage, 'code': code, 'message': message} for file in files]
+
+
+def _message_body(file, sizes):
+    if file in sizes:
+        return json.dumps({'uid': file, 'size': sizes[file]})
+    return json.dumps({'uid': file})
 
-def lambda_handler(event, context):
-    files_to_process = event
-    expiry = int((datetime.datetime.now() + datetime.timedelta(days=TIME_TO_LIVE_DAYS)).timestamp())
 
-    sqs = LambdaSQSClass(LAMBDA_SQS_RESOURCE)
-    queue_url = sqs.queue.url
+def _send_message_batch(files, queue, sizes):
+    """
+    Send one SQS SendMessageBatch request to queue, retrying only the failed entries.
+    Returns (responses, failures).
+    """
+    entries = {
+        str(index): {
+            'Id': str(index),
+            'MessageBody': _message_body(file, sizes),
+        }
+        for index, file in enumerate(files)
+    }
     responses = []
+    failures = []
 
-    for index, file in enumerate(files_to_process):
-        logger.info(f"Processing file: {file} [{(index+1)}/{len(files_to_process)}]")
-        ddb_state_resource = LambdaDynamoDBClass(LAMBDA_DYNAMODB_RESOURCE)
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            response = queue.client.send_message_batch(
+                QueueUrl=queue.queue.url,
+                Entries=list(entries.values())
+            )
+        except (ClientError, BotoCoreError) as e:
+            # Entries sent by earlier attempts stay reported as sent. A timed out request may have
+            # been sent, it is not retried so the documents are not enqueued twice
+            logger.error(f"SQS batch send failed: {e}")
+            failures.extend(_error_failures([files[int(entry_id)] for entry_id in entries], 'sqs', e))
+            return responses, failures
 
-        logger.info(f"Adding file to Dynamo: {file}")
-        table = ddb_state_resource.table
-        # Set expiration
+        for success in response.get('Successful', []):
+            entry = entries.pop(success['Id'])
+            responses.append({
+                'uid': files[int(success['Id'])],
+                'message': entry['MessageBody'],
+                'sqs_response_md5': success['MD5OfMessageBody']
+            })
 
-        table.put_item(
-            Item={
-                's3_path': file,
-                'status': "INGESTED",
-                'ttl': expiry
-            }
-        )
+        retryable = {}
+        for failed in response.get('Failed', []):
+            if failed.get('SenderFault'):
+                entries.pop(failed['Id'])
+                failures.append({
+                    'uid': files[int(failed['Id'])],
+                    'stage': 'sqs',
+                    'code': failed.get('Code'),
+                    'message': failed.get('Message')
+                })
+            else:
+                retryable[failed['Id']] = entries[failed['Id']]
 
-        message = json.dumps({
-            'uid': file,
-        })
+        entries = retryable
+        if not entries:
+            break
 
-        logger.info("Adding Message to SQS Queue for file: %s" % file)
-        sqs_response = sqs.queue.send_message(
-            QueueUrl=queue_url,
-            MessageBody=message
-        )
+        logger.info(f"Retrying {len(entries)} failed SQS entries (attempt {attempt + 1})")
+        _backoff(attempt)
 
-        responses.append({
-            'uid': file,
-            'message': message,
-            'sqs_response_md5': sqs_response['MD5OfMessageBody']
+    for entry_id in entries:
+        failures.append({
+            'uid': files[int(entry_id)],
+            'stage': 'sqs',
+            'code': 'MaxAttemptsExceeded',
+            'message': f'Message not sent after {MAX_ATTEMPTS} attempts'
         })
-        logger.info("Successfully added Message to SQS Queue for file: %s" % file)
+
+    return responses, failures
+
+
+def _ingest_batch(files, expiry, queue, sizes):
+    """
+    Record state for up to 25 files and enqueue the ones that were recorded. Errors are
+    reported as failures of the files in the batch, so the other batches still land.
+    """
+    failures = []
+    responses = []
+
+    failures.extend(_write_state_batch(files, expiry))
+    unwritten = {failure['uid'] for failure in failures}
+
+    written = [file for file in files if file not in unwritten]
+    for sqs_batch in _chunks(written, SQS_BATCH_SIZE):
+        batch_responses, batch_failures = _send_message_batch(sqs_batch, queue, sizes)
+        responses.extend(batch_responses)
+        failures.extend(batch_failures)
+
+    return responses, failures
+
+
+def _record_batch_landed(run_id, enqueued, failed, expiry):
+    """
+    Atomically count this batch on the run's counter item so extract_paths_in_s3 can
+    tell when every batch it fanned out has landed.
+    """
+    ddb_state_resource.client.update_item(
+        TableName=ddb_state_resource.table_name,
+        Key={'s3_path': {'S': f"{RUN_KEY_PREFIX}{run_id}"}},
+        UpdateExpression='ADD batches_landed :one, files_enqueued :enqueued, files_failed :failed SET #ttl = :ttl',
+        ExpressionAttributeNames={'#ttl': 'ttl'},
+        ExpressionAttributeValues={
+            ':one': {'N': '1'},
+            ':enqueued': {'N': str(enqueued)},
+            ':failed': {'N': str(failed)},
+            ':ttl': {'N': str(expiry)}
+        }
+    )
+
+
+def lambda_handler(event, context):
+    # extract_paths_in_s3 sends {"run_id": ..., "lane": ..., "files": [...], "sizes": [...]}, a bare list is still accepted
+    if isinstance(event, dict):
+        run_id = event.get('run_id')
+        files_to_process = event.get('files', [])
+        sizes = dict(zip(files_to_process, event.get('sizes', [])))
+        queue = large_sqs if event.get('lane') == 'large' else sqs
+    else:
+        run_id = None
+        files_to_process = event
+        sizes = {}
+        queue = sqs
+
+    expiry = int((datetime.datetime.now() + datetime.timedelta(days=TIME_TO_LIVE_DAYS)).timestamp())
+
+    batches = _chunks(files_to_process, INGEST_BATCH_SIZE)
+    logger.info(f"Ingesting {len(files_to_process)} files in {len(batches)} batches")
+
+    responses = []
+    failures = []
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for batch_responses, batch_failures in executor.map(lambda batch: _ingest_batch(batch, expiry, queue, sizes), batches):
+            responses.extend(batch_responses)
+            failures.extend(batch_failures)
+
+    logger.info(f"Successfully added {len(responses)} messages to SQS Queue")
+    if failures:
+        logger.error(f"Failed to ingest {len(failures)} files: {failures}")
+
+    if run_id:
+        _record_batch_landed(run_id, len(responses), len(failures), expiry)
 
     return {
-        'statusCode': 200,  # accepted
+        'statusCode': 207 if failures else 200,
         'headers': {
                 "Access-Control-Allow-Headers": "Content-Type",
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
         },
         'body': json.dumps({
-            'responses': responses
+            'responses': responses,
+            'failures': failures
         }),
     }
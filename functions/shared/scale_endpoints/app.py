@@ -0,0 +1,152 @@
+import ast
+import boto3
+import datetime
+import json
+import os
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
+from scaling import next_instance_count, target_instance_count
+
+logger = Logger()
+
+ENV = os.environ['ENV']
+LLM_ENDPOINT_NAME = f"{ENV}-{os.environ['LLM_ENDPOINT_NAME']}"
+NER_ENDPOINT_NAME = f"{ENV}-{os.environ['NER_ENDPOINT_NAME']}"
+STATE_MACHINE_ARN = os.environ['GEN_AI_STATE_MACHINE_ARN']
+QUEUE_URLS = [url for url in (os.environ['FILE_SQS_QUEUE_NAME'], os.environ.get('LARGE_FILE_SQS_QUEUE_NAME', '')) if url]
+# {"llm": {"min": 1, "max": 4}, "ner": {"min": 1, "max": 2}}
+ENDPOINT_INSTANCE_COUNTS = ast.literal_eval(os.environ['ENDPOINT_INSTANCE_COUNTS'])
+# Requests one instance serves at once, TGI batches concurrent requests on the LLM
+CONCURRENCY_PER_INSTANCE = ast.literal_eval(os.environ.get('CONCURRENCY_PER_INSTANCE', '{"llm": 8, "ner": 4}'))
+# Title and abstract call the LLM, author extraction calls the NER model
+CALLS_PER_DOCUMENT = {'llm': 2, 'ner': 1}
+# Backlog is sized to be worked off in this time
+TARGET_DRAIN_SECONDS = int(os.environ.get('TARGET_DRAIN_SECONDS', 3600))
+# Documents the state machine processes at once, one FetchFromSQS wave
+PARALLEL_DOCUMENTS = int(os.environ.get('MAX_CONCURRENCY', 100))
+SCALE_DOWN_COOLDOWN_SECONDS = int(os.environ.get('SCALE_DOWN_COOLDOWN_SECONDS', 900))
+LATENCY_WINDOW_SECONDS = int(os.environ.get('LATENCY_WINDOW_SECONDS', 600))
+# Used until the endpoint has reported its ModelLatency
+DEFAULT_SECONDS_PER_CALL = ast.literal_eval(os.environ.get('DEFAULT_SECONDS_PER_CALL', '{"llm": 20, "ner": 1}'))
+
+ENDPOINTS = {'llm': LLM_ENDPOINT_NAME, 'ner': NER_ENDPOINT_NAME}
+
+sagemaker = boto3.client('sagemaker')
+sqs = boto3.client('sqs')
+cloudwatch = boto3.client('cloudwatch')
+sfn = boto3.client('stepfunctions')
+
+
+def queue_backlog():
+    """
+    Documents waiting in or being processed from the file processing queues
+    """
+    backlog = 0
+    for queue_url in QUEUE_URLS:
+        attributes = sqs.get_queue_attributes(
+            QueueUrl=queue_url,
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+        )['Attributes']
+        backlog += int(attributes['ApproximateNumberOfMessages']) + int(attributes['ApproximateNumberOfMessagesNotVisible'])
+    return backlog
+
+
+def execution_running():
+    """
+    True while an execution of the state machine is running
+    """
+    return bool(sfn.list_executions(stateMachineArn=STATE_MACHINE_ARN, statusFilter='RUNNING', maxResults=1)['executions'])
+
+
+def seconds_per_call(model_type, endpoint_name, variant_name):
+    """
+    Average ModelLatency of the endpoint over the last LATENCY_WINDOW_SECONDS
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    datapoints = cloudwatch.get_metric_statistics(
+        Namespace='AWS/SageMaker',
+        MetricName='ModelLatency',
+        Dimensions=[
+            {'Name': 'EndpointName', 'Value': endpoint_name},
+            {'Name': 'VariantName', 'Value': variant_name}
+        ],
+        StartTime=now - datetime.timedelta(seconds=LATENCY_WINDOW_SECONDS),
+        EndTime=now,
+        Period=LATENCY_WINDOW_SECONDS,
+        Statistics=['Average', 'SampleCount']
+    )['Datapoints']
+    samples = sum(point['SampleCount'] for point in datapoints)
+    if not samples:
+        return DEFAULT_SECONDS_PER_CALL[model_type]
+    # ModelLatency is reported in microseconds
+    return sum(point['Average'] * point['SampleCount'] for point in datapoints) / samples / 1_000_000
+
+
+def scale_endpoint(model_type, endpoint_name, backlog, scale_down_allowed):
+    try:
+        endpoint = sagemaker.describe_endpoint(EndpointName=endpoint_name)
+    except ClientError as e:
+        logger.info(f"{endpoint_name} not scaled: {e}")
+        return None
+
+    # Capacity can only be updated while the endpoint is in service
+    if endpoint['EndpointStatus'] != 'InService':
+        logger.info(f"{endpoint_name} is {endpoint['EndpointStatus']}, not scaled")
+        return None
+
+    variant = endpoint['ProductionVariants'][0]
+    current = variant['CurrentInstanceCount']
+    seconds_per_document = CALLS_PER_DOCUMENT[model_type] * seconds_per_call(model_type, endpoint_name, variant['VariantName'])
+    bounds = ENDPOINT_INSTANCE_COUNTS[model_type]
+    target = target_instance_count(
+        backlog=backlog,
+        seconds_per_document=seconds_per_document,
+        concurrency_per_instance=CONCURRENCY_PER_INSTANCE[model_type],
+        drain_seconds=TARGET_DRAIN_SECONDS,
+        parallel_documents=PARALLEL_DOCUMENTS,
+        min_instances=bounds['min'],
+        max_instances=bounds['max']
+    )
+    seconds_since_update = (datetime.datetime.now(datetime.timezone.utc) - endpoint['LastModifiedTime']).total_seconds()
+    count = next_instance_count(current, target, seconds_since_update, SCALE_DOWN_COOLDOWN_SECONDS, scale_down_allowed)
+
+    decision = {
+        'endpoint': endpoint_name,
+        'backlog': backlog,
+        'seconds_per_document': round(seconds_per_document, 3),
+        'current': current,
+        'target': target,
+        'scale_down_allowed': scale_down_allowed,
+        'desired': count
+    }
+    logger.info(f"Scaling decision: {json.dumps(decision)}")
+
+    if count != current:
+        sagemaker.update_endpoint_weights_and_capacities(
+            EndpointName=endpoint_name,
+            DesiredWeightsAndCapacities=[{'VariantName': variant['VariantName'], 'DesiredInstanceCount': count}]
+        )
+    return decision
+
+
+def lambda_handler(event, context):
+    """
+    Size the LLM and NER endpoints to the backlog of the file processing queues. Runs on a schedule,
+    endpoints that do not exist or are being created, updated or deleted are left alone. Endpoints are
+    only scaled down while a run is working off a backlog: once the queues are empty the run is ending
+    and deletes the endpoints, which fails while an update is in progress.
+    """
+    backlog = queue_backlog()
+    scale_down_allowed = backlog > 0 and execution_running()
+    decisions = [
+        decision for decision in (
+            scale_endpoint(model_type, endpoint_name, backlog, scale_down_allowed)
+            for model_type, endpoint_name in ENDPOINTS.items()
+        )
+        if decision
+    ]
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(decisions)
+    }
@@ -0,0 +1,32 @@
+import math
+
+# Scaling decisions only, without AWS calls, so they can be run against a simulated queue
+
+
+def target_instance_count(backlog, seconds_per_document, concurrency_per_instance, drain_seconds,
+                          parallel_documents, min_instances, max_instances):
+    """
+    Instances needed to work off backlog documents within drain_seconds. A document keeps the
+    endpoint busy for seconds_per_document and an instance serves concurrency_per_instance requests
+    at once. The state machine never has more than parallel_documents documents in flight, so
+    instances beyond what they can keep busy are not counted.
+    """
+    if backlog <= 0:
+        return min_instances
+    needed = math.ceil(backlog * seconds_per_document / (drain_seconds * concurrency_per_instance))
+    usable = math.ceil(parallel_documents / concurrency_per_instance)
+    return max(min_instances, min(max_instances, needed, usable))
+
+
+def next_instance_count(current, target, seconds_since_update, scale_down_cooldown_seconds, scale_down_allowed=True):
+    """
+    Instance count to apply now. Scaling up is immediate, scaling down waits scale_down_cooldown_seconds
+    after the last endpoint update and at most halves the instances at a time, so a short dip in the
+    backlog does not release capacity that has to be provisioned again. Without scale_down_allowed the
+    count is kept, the endpoints are deleted at the end of a run and must not be updating then.
+    """
+    if target > current:
+        return target
+    if target < current and scale_down_allowed and seconds_since_update >= scale_down_cooldown_seconds:
+        return max(target, math.ceil(current / 2))
+    return current
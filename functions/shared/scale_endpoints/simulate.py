@@ -0,0 +1,87 @@
+"""
+Offline simulation of the scaling decisions against a simulated queue, without AWS calls, to
+tune the drain time, cooldown and instance bounds before changing them.
+
+    python simulate.py
+
+Every minute, like the schedule of the scaling function, the controller sizes one endpoint to the
+backlog. The endpoint works the backlog off at the rate of its instances, and capacity updates take
+UPDATE_SECONDS, during which the endpoint is Updating and left alone. The run ends once the queue is
+empty and the last documents are done, then the endpoint is deleted. Each scenario prints its
+instance counts over time, the updates it started and how long the deletion waited for an update.
+"""
+import math
+
+from scaling import next_instance_count, target_instance_count
+
+STEP_SECONDS = 60
+UPDATE_SECONDS = 600
+SCALE_DOWN_COOLDOWN_SECONDS = 900
+
+
+def simulate(backlog, seconds_per_document, concurrency_per_instance=8, drain_seconds=3600, parallel_documents=100,
+             min_instances=1, max_instances=8, arrivals=None, max_minutes=24 * 60):
+    """
+    Minute by minute history of the run as dicts, and the seconds the deletion waited for an update.
+    arrivals maps a minute to the documents added to the queue then.
+    """
+    arrivals = arrivals or {}
+    current = min_instances
+    last_update = -SCALE_DOWN_COOLDOWN_SECONDS
+    pending = None
+    queued = float(backlog)
+    history = []
+
+    for minute in range(max_minutes):
+        now = minute * STEP_SECONDS
+        if pending is not None and now >= pending[1]:
+            current, pending = pending[0], None
+        queued += arrivals.get(minute, 0)
+
+        # A running execution always runs the controller, scale-down only while there is a backlog
+        target = target_instance_count(queued, seconds_per_document, concurrency_per_instance, drain_seconds,
+                                       parallel_documents, min_instances, max_instances)
+        started_update = False
+        if pending is None:
+            count = next_instance_count(current, target, now - last_update, SCALE_DOWN_COOLDOWN_SECONDS,
+                                        scale_down_allowed=queued > 0)
+            if count != current:
+                pending = (count, now + UPDATE_SECONDS)
+                last_update = now
+                started_update = True
+
+        history.append({'minute': minute, 'queued': int(queued), 'instances': current, 'target': target,
+                        'started_update': started_update})
+        if queued == 0 and minute > max(arrivals, default=0):
+            # The last wave takes one document time, then the endpoint is deleted once it is not Updating
+            end = now + seconds_per_document
+            waited = max(0, pending[1] - end) if pending is not None else 0
+            return history, waited
+
+        throughput = min(current * concurrency_per_instance, parallel_documents) / seconds_per_document * STEP_SECONDS
+        queued = max(0.0, queued - throughput)
+
+    raise RuntimeError(f"backlog of {queued:.0f} documents not worked off in {max_minutes} minutes")
+
+
+def report(name, history, waited):
+    peak = max(step['instances'] for step in history)
+    updates = sum(step['started_update'] for step in history)
+    print(f"{name}: {len(history)} minutes, peak {peak} instances, {updates} updates, "
+          f"deletion waited {waited:.0f}s")
+    for step in history[::max(1, math.ceil(len(history) / 12))]:
+        print(f"  minute {step['minute']:4d}: queued {step['queued']:6d}, instances {step['instances']}, "
+              f"target {step['target']}")
+
+
+SCENARIOS = {
+    'steady backlog': dict(backlog=20_000, seconds_per_document=40),
+    'late arrivals': dict(backlog=5_000, seconds_per_document=40, arrivals={120: 10_000, 240: 2_000}),
+    'small run': dict(backlog=200, seconds_per_document=40),
+    'fast model': dict(backlog=50_000, seconds_per_document=2, concurrency_per_instance=4, max_instances=2),
+}
+
+
+if __name__ == '__main__':
+    for name, scenario in SCENARIOS.items():
+        report(name, *simulate(**scenario))
@@ -1,21 +1,105 @@
 import logging
 import os
-import aws_sqs_batchlib
+import time
+import boto3
+from botocore.config import Config
 
 ENV = os.environ.get('ENV')
 SQS_URL = os.environ.get("FILE_SQS_QUEUE_NAME", "NONE")
+# Large documents are received before the others, so they start in the first waves of a run
+LARGE_SQS_URL = os.environ.get("LARGE_FILE_SQS_QUEUE_NAME", "")
 MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", 100))
 
+# Wave size control: the size grows by RECEIVE_SIZE_INCREASE after a full wave that finished within
+# TARGET_WAVE_SECONDS without failures, and is cut by RECEIVE_SIZE_DECREASE after a slow wave or one
+# where more than MAX_FAILURE_RATE of the documents failed. The EXPRESS document executions are
+# stopped after 300 seconds, so a wave is slow well before its documents time out
+INITIAL_RECEIVE_SIZE = int(os.environ.get("INITIAL_RECEIVE_SIZE", 20))
+MIN_RECEIVE_SIZE = int(os.environ.get("MIN_RECEIVE_SIZE", 5))
+RECEIVE_SIZE_INCREASE = int(os.environ.get("RECEIVE_SIZE_INCREASE", 10))
+RECEIVE_SIZE_DECREASE = float(os.environ.get("RECEIVE_SIZE_DECREASE", 0.5))
+TARGET_WAVE_SECONDS = int(os.environ.get("TARGET_WAVE_SECONDS", 180))
+MAX_FAILURE_RATE = float(os.environ.get("MAX_FAILURE_RATE", 0.05))
+# Long polling queries every SQS server, so an empty receive means the queue is drained and ends the run
+WAIT_TIME_SECONDS = int(os.environ.get("WAIT_TIME_SECONDS", 20))
+# The large document lane is filled before the run starts, it is not waited on
+LARGE_WAIT_TIME_SECONDS = int(os.environ.get("LARGE_WAIT_TIME_SECONDS", 1))
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+sqs = boto3.client('sqs', config=Config(read_timeout=WAIT_TIME_SECONDS + 10))
+
+
+def next_receive_size(controller, wave, now):
+    """
+    Size of the next wave from the size, receive time and message count of the previous one
+    (controller) and its per-document results (wave). The duration of a wave is that of its
+    slowest document, so slow endpoints, throttling and stage retries all lengthen it. Documents
+    sent to the DLQ and document executions that failed or timed out, which return an error or
+    no result, are failures.
+    """
+    size = controller.get('size')
+    if not size:
+        return min(INITIAL_RECEIVE_SIZE, MAX_CONCURRENCY)
+
+    received = controller.get('received', 0)
+    if not received:
+        return size
+
+    seconds = now - controller['received_at']
+    succeeded = sum(1 for result in wave if isinstance(result, dict) and result.get('failed') is False)
+    failure_rate = (received - min(succeeded, received)) / received
+    if seconds > TARGET_WAVE_SECONDS or failure_rate > MAX_FAILURE_RATE:
+        next_size = max(MIN_RECEIVE_SIZE, int(size * RECEIVE_SIZE_DECREASE))
+    elif received >= size:
+        next_size = min(MAX_CONCURRENCY, size + RECEIVE_SIZE_INCREASE)
+    else:
+        # The queue did not fill the wave, which says nothing about the endpoints
+        next_size = size
+
+    logger.info(f"Previous wave: {received} documents in {seconds:.0f}s, failure rate {failure_rate:.2f}, "
+                f"receive size {size} -> {next_size}")
+    return next_size
+
+
+def receive(queue_url, count, wait_time_seconds):
+    """
+    Up to count messages, stops at the first receive that comes back empty. Only the first receive
+    waits wait_time_seconds, once messages arrive the queue is not waited on again, so a wave the
+    queue cannot fill does not end with a long poll.
+    """
+    messages = []
+    while len(messages) < count:
+        batch = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(count - len(messages), 10),
+            WaitTimeSeconds=0 if messages else wait_time_seconds
+        ).get('Messages', [])
+        if not batch:
+            break
+        messages.extend(batch)
+    return messages
+
 
 def lambda_handler(event, context):
-    logger.info(event)
-
-    res = aws_sqs_batchlib.receive_message(
-        QueueUrl=SQS_URL,
-        MaxNumberOfMessages=MAX_CONCURRENCY,
-        
-    )
-    return res
+    controller = event.get('Controller') or {}
+    wave = event.get('Wave') or []
+    size = next_receive_size(controller, wave, time.time())
+
+    messages = []
+    for queue_url, wait_time_seconds in [(LARGE_SQS_URL, LARGE_WAIT_TIME_SECONDS), (SQS_URL, WAIT_TIME_SECONDS)]:
+        if not queue_url or len(messages) >= size:
+            continue
+        # Messages of the large document lane already make a wave, the other queue is not waited on
+        for message in receive(queue_url, size - len(messages), 0 if messages else wait_time_seconds):
+            # The state machine deletes each message from the queue it was received from
+            message['QueueUrl'] = queue_url
+            messages.append(message)
+
+    logger.info(f"Received {len(messages)} messages of {size}")
+    return {
+        'Messages': messages,
+        # Passed back by the state machine with the results of this wave
+        'Controller': {'size': size, 'received': len(messages), 'received_at': time.time()}
+    }
@@ -0,0 +1,207 @@
+import boto3
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.metrics import MetricUnit, single_metric
+from botocore.exceptions import ClientError
+from genai_common.generation import TITLE_PROMPT_TEMPLATE
+from genai_common.inference_client import InferenceClient
+from genai_common.llm_response import generation_payload
+
+logger = Logger()
+
+ENV = os.environ['ENV']
+LLM_ENDPOINT_NAME = f"{ENV}-{os.environ['LLM_ENDPOINT_NAME']}"
+NER_ENDPOINT_NAME = f"{ENV}-{os.environ['NER_ENDPOINT_NAME']}"
+EXTRACT_PATHS_LAMBDA = os.environ['EXTRACT_PATHS_LAMBDA']
+DOC_DDB_STATE_TABLE = os.environ['DOC_DDB_STATE_TABLE']
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'GenAiStateMachine')
+
+# Wait for both endpoints to be InService, polling with backoff from WAIT_BASE_DELAY to WAIT_MAX_DELAY seconds
+ENDPOINT_WAIT_SECONDS = int(os.environ.get('ENDPOINT_WAIT_SECONDS', 300))
+WAIT_BASE_DELAY = float(os.environ.get('WAIT_BASE_DELAY', 5))
+WAIT_MAX_DELAY = float(os.environ.get('WAIT_MAX_DELAY', 60))
+# Warm-up ends when the last STABLE_ROUNDS round latencies are within LATENCY_TOLERANCE of their minimum
+STABLE_ROUNDS = int(os.environ.get('WARMUP_STABLE_ROUNDS', 3))
+LATENCY_TOLERANCE = float(os.environ.get('WARMUP_LATENCY_TOLERANCE', 0.2))
+MAX_WARMUP_ROUNDS = int(os.environ.get('WARMUP_MAX_ROUNDS', 20))
+# The pipeline is released after this time even if latency has not settled, the endpoints cost the same idle
+WARMUP_TIMEOUT_SECONDS = int(os.environ.get('WARMUP_TIMEOUT_SECONDS', 300))
+TIME_TO_LIVE_DAYS = int(os.environ.get('DOC_STATE_TTL_DAYS', 30))
+
+# Keeps the warm-up of one deployment apart from the document items of the state table
+WARMUP_KEY_PREFIX = "warmup#"
+FINAL_STATUSES = {'Failed', 'OutOfService', 'Deleting', 'RollingBack'}
+
+WARMUP_TEXT = (
+    "Jane Smith and John Doe, Department of Physics. Abstract: We measure the thermal conductivity "
+    "of thin films grown at different temperatures and compare the results with a simple model."
+)
+# LLM requests generate a single token, so their latency is the time to the first token
+DEFAULT_WARMUP_PAYLOADS = {
+    'llm': [
+        generation_payload(TITLE_PROMPT_TEMPLATE.format(text=WARMUP_TEXT), max_new_tokens=1),
+        generation_payload(TITLE_PROMPT_TEMPLATE.format(text=" ".join([WARMUP_TEXT] * 40)), max_new_tokens=1)
+    ],
+    'ner': [json.dumps({"inputs": WARMUP_TEXT})]
+}
+# {"llm": [<request body>, ...], "ner": [...]}, every round sends each body once per instance
+WARMUP_PAYLOADS = {
+    model_type: [json.dumps(payload) for payload in payloads]
+    for model_type, payloads in json.loads(os.environ['WARMUP_PAYLOADS']).items()
+} if os.environ.get('WARMUP_PAYLOADS') else DEFAULT_WARMUP_PAYLOADS
+
+ENDPOINTS = {'llm': LLM_ENDPOINT_NAME, 'ner': NER_ENDPOINT_NAME}
+
+sagemaker = boto3.client('sagemaker')
+lambda_client = boto3.client('lambda')
+ddb = boto3.client('dynamodb')
+
+
+def wait_in_service(timeout):
+    """
+    DescribeEndpoint responses of both endpoints once they are InService, None if one of them
+    is not within timeout seconds or has failed
+    """
+    deadline = time.monotonic() + timeout
+    delay = WAIT_BASE_DELAY
+    while True:
+        endpoints = {}
+        for model_type, endpoint_name in ENDPOINTS.items():
+            try:
+                endpoints[model_type] = sagemaker.describe_endpoint(EndpointName=endpoint_name)
+            except ClientError as e:
+                logger.info(f"{endpoint_name} not available: {e}")
+                return None
+
+        statuses = {endpoint['EndpointName']: endpoint['EndpointStatus'] for endpoint in endpoints.values()}
+        logger.info(f"Endpoint statuses: {statuses}")
+        if all(status == 'InService' for status in statuses.values()):
+            return endpoints
+        if FINAL_STATUSES & set(statuses.values()):
+            return None
+        if time.monotonic() + delay > deadline:
+            return None
+
+        time.sleep(delay)
+        delay = min(delay * 2, WAIT_MAX_DELAY)
+
+
+def latency_stabilized(latencies):
+    """
+    True when the last STABLE_ROUNDS latencies are within LATENCY_TOLERANCE of their minimum
+    """
+    if len(latencies) < STABLE_ROUNDS:
+        return False
+    window = latencies[-STABLE_ROUNDS:]
+    return max(window) <= min(window) * (1 + LATENCY_TOLERANCE)
+
+
+def _emit_metric(endpoint_name, latency_ms):
+    # The LLM and NER endpoints are warmed up concurrently, each round is flushed on its own
+    with single_metric(name='WarmUpLatency', unit=MetricUnit.Milliseconds, value=latency_ms,
+                       namespace=METRICS_NAMESPACE) as metric:
+        metric.add_dimension(name='EndpointName', value=endpoint_name)
+
+
+def warm_up(model_type, endpoint, deadline):
+    """
+    Send rounds of warm-up requests until the round latency stabilizes, the round limit is reached
+    or deadline passes. A round sends every payload once per instance at the same time and its
+    latency is that of the slowest request.
+    """
+    endpoint_name = endpoint['EndpointName']
+    instances = max(variant['CurrentInstanceCount'] for variant in endpoint['ProductionVariants'])
+    payloads = WARMUP_PAYLOADS[model_type] * instances
+    client = InferenceClient(endpoint_name)
+
+    latencies = []
+    with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+        while True:
+            round_latencies = list(executor.map(lambda payload: client.invoke(payload).latency_ms, payloads))
+            latencies.append(max(round_latencies))
+            _emit_metric(endpoint_name, latencies[-1])
+
+            stabilized = latency_stabilized(latencies)
+            if stabilized or len(latencies) >= MAX_WARMUP_ROUNDS or time.monotonic() > deadline:
+                break
+
+    logger.info(f"{endpoint_name} warm-up latencies_ms: {latencies}, stabilized: {stabilized}")
+    return {'endpoint': endpoint_name, 'instances': instances, 'latencies_ms': latencies, 'stabilized': stabilized}
+
+
+def claim(key):
+    """
+    Record the warm-up of this deployment, False if another invocation has already claimed it
+    """
+    try:
+        ddb.put_item(
+            TableName=DOC_DDB_STATE_TABLE,
+            Item={
+                's3_path': {'S': key},
+                'started_at': {'N': str(int(time.time()))},
+                'ttl': {'N': str(int(time.time()) + TIME_TO_LIVE_DAYS * 86400)}
+            },
+            ConditionExpression='attribute_not_exists(s3_path)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+def lambda_handler(event, context):
+    """
+    Triggered when an endpoint enters service. Waits for both endpoints, warms them up and starts
+    the pipeline through Extract Paths in S3 once their latency has settled. Each deployment is
+    warmed up once, later state changes such as capacity updates do not start the pipeline again.
+    """
+    endpoints = wait_in_service(min(ENDPOINT_WAIT_SECONDS, context.get_remaining_time_in_millis() / 1000 - 60))
+    if endpoints is None:
+        logger.info("Endpoints are not both in service, the next endpoint state change retries")
+        return {'statusCode': 200, 'body': json.dumps({'released': False})}
+
+    # Endpoints are recreated for every run, their creation times identify the deployment
+    key = WARMUP_KEY_PREFIX + "#".join(
+        endpoints[model_type]['CreationTime'].isoformat() for model_type in sorted(endpoints)
+    )
+    if not claim(key):
+        logger.info(f"{key} is already warmed up or warming up")
+        return {'statusCode': 200, 'body': json.dumps({'released': False})}
+
+    try:
+        deadline = time.monotonic() + min(WARMUP_TIMEOUT_SECONDS, context.get_remaining_time_in_millis() / 1000 - 30)
+        with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+            results = list(executor.map(lambda item: warm_up(item[0], item[1], deadline), endpoints.items()))
+    except Exception:
+        # Let the retry of this invocation claim the deployment again
+        ddb.delete_item(TableName=DOC_DDB_STATE_TABLE, Key={'s3_path': {'S': key}})
+        raise
+
+    if not all(result['stabilized'] for result in results):
+        logger.warning("Latency did not settle within the warm-up limits, releasing the pipeline")
+
+    ddb.update_item(
+        TableName=DOC_DDB_STATE_TABLE,
+        Key={'s3_path': {'S': key}},
+        UpdateExpression='SET warm_up = :warm_up, released_at = :released_at',
+        ExpressionAttributeValues={
+            ':warm_up': {'S': json.dumps(results)},
+            ':released_at': {'N': str(int(time.time()))}
+        }
+    )
+
+    lambda_client.invoke(
+        FunctionName=EXTRACT_PATHS_LAMBDA,
+        InvocationType='Event',
+        Payload=json.dumps({'warm_up': results})
+    )
+    logger.info("Pipeline released")
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'released': True, 'warm_up': results})
+    }